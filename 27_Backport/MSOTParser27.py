@@ -52,6 +52,15 @@ def validate_tbl_format(infile_content):
     return(tbl_type)
 
 
+def csv_value(value):
+
+    ''' The Python 2 csv module writes byte strings, so decoded text is encoded as UTF-8. '''
+
+    if isinstance(value, unicode):
+        return(value.encode('utf-8'))
+    return(value)
+
+
 def build_entry_dict(sln_table, evt_table):
 
     ''' Build a dict from the entries parsed from sln_table and evt_table, to associate
@@ -162,7 +171,9 @@ if __name__ == '__main__':
 
         # Get the evt table values for this document. There can be multiple entries per docid.
         for entry in range(len(docid_offsets[docid][1])):
-            timestamp  = evt_table.entries[docid_offsets[docid][1][entry]][5].strftime('%Y-%m-%d %H:%M:%S.%f')
+            timestamp  = evt_table.entries[docid_offsets[docid][1][entry]][5]
+            # Timestamps that were never set are None, and left blank
+            timestamp  = timestamp.strftime('%Y-%m-%d %H:%M:%S.%f') if timestamp is not None else ''
             entry_num  = evt_table.entries[docid_offsets[docid][1][entry]][0]
             event_id   = evt_table.entries[docid_offsets[docid][1][entry]][2]
             event_desc = evt_table.entries[docid_offsets[docid][1][entry]][3]
@@ -174,4 +185,4 @@ if __name__ == '__main__':
         writer.writerow(['Timestamp','Entry #', 'Event ID', 'Event Description', 'Document ID', 'Document Title', 'Document Path', 'Document Type', 'Document Author', 'Add-in Name', 'Description'])
         # Add all of the parsed results
         for result in results:
-            writer.writerow(result)
+            writer.writerow([csv_value(value) for value in result])
@@ -1,6 +1,13 @@
 import binascii
+import struct
 from misc_functions27 import *
 
+
+# evt.tbl consists of 156-byte blocks beginning at offset 40. evt_block_struct reads the known fields of a block:
+# entry number (4 - 7), timestamp 1 (24 - 31), event ID (36 - 39), GUID (40 - 55) and timestamp 2 (136 - 143).
+evt_block_size = 156
+evt_block_struct = struct.Struct('<4xI16xQ4xI16s80xQ')
+
 class evtTable:
 
     def __init__(self, infile_content):
@@ -12,6 +19,7 @@ class evtTable:
             # key: offset
             # value: list [entry_num,  timestamp 1, event_id, event_desc, GUID, timestamp 2]
             #                 0            1          2         3          4         5
+            # Timestamps are datetimes, or None if they were never set.
 
         # dict containing definitions for the event_id codes. These are listed in full at:
         # https://msdn.microsoft.com/en-us/library/office/jj230106.aspx
@@ -40,42 +48,37 @@ class evtTable:
 
     def parse_entries(self):
 
+        ''' Parse every table entry into self.entries. '''
+
+        for offset, entry in self.iter_entries():
+            self.entries[offset] = entry
+
+    def iter_entries(self):
+
+        ''' Generator yielding (offset, entry) for each table entry, in file order. Entries are lists in the
+            format of self.entries, keyed by the offset of the entry number field. Each block is read with a
+            single struct call. '''
+
         doc_length = len(self.infile_content)
         byte = 40 # Start reading the evt file at the first entry
 
-        # Search through the file content in memory, looking for the table entries.
-        while(byte < doc_length):
+        # Only whole blocks are parsed
+        while byte + evt_block_size <= doc_length:
 
-            # The first field is block length, which is always 156
-            # No need to store this field
-            offset = byte + 4
-            self.entries[offset] = []
+            # The first field is block length, which is always 156. No need to store this field.
+            entry_num, timestamp1, event_id, guid, timestamp2 = evt_block_struct.unpack_from(self.infile_content, byte)
 
-            # The entry number is the second byte
-            entry_num = self.infile_content[byte+4]
-            self.entries[offset].append(int(binascii.hexlify(entry_num), 16))
+            # Event ID can be mapped to a text description in self.event_codes
+            event_desc = self.event_codes.get(event_id, 'Unknown')
 
-            # Timestamp at offsets 24 - 31
-            timestamp1 = self.infile_content[byte+24:byte+32]
-            timestamp1_hex = binascii.hexlify(timestamp1)
-            self.entries[offset].append(convert_time(timestamp1_hex))
+            yield (byte + 4, [entry_num, filetime_to_datetime(timestamp1), event_id, event_desc,
+                              binascii.hexlify(guid), filetime_to_datetime(timestamp2)])
 
-            # The event ID is at offset 36 (one byte)
-            event_id = (int(binascii.hexlify(self.infile_content[byte+36]), 16))
-            self.entries[offset].append(event_id)
-            # Event ID can be mapped to a text description in self.event_codes
-            if event_id in self.event_codes:
-                event_desc = self.event_codes[event_id]
-            else:
-                event_desc = 'Unknown'
-            self.entries[offset].append(event_desc)
+            byte += evt_block_size # Jump to next entry
 
-            # The GUID is offsets 40-55
-            self.entries[offset].append(binascii.hexlify(self.infile_content[byte+40:byte+56]))
+    def iter_batches(self, batch_size=1000):
 
-            # Timestamp at offsets 136 - 143
-            timestamp2 = self.infile_content[byte+136:byte+144]
-            timestamp2_hex = binascii.hexlify(timestamp2)
-            self.entries[offset].append(convert_time(timestamp2_hex))
+        ''' Generator yielding lists of at most batch_size (offset, entry) pairs, so a caller (such as an Autopsy
+            ingest module) can process and commit the entries in chunks. '''
 
-            byte += 156 # Jump to next entry
+        return(iter_batches(self.iter_entries(), batch_size))
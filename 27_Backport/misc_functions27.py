@@ -4,57 +4,56 @@
 #
 ###############################################################################
 
+import struct
 from datetime import datetime, timedelta
-from itertools import izip_longest
 
 
-def convert_time(timestamp):
-    ''' Windows NT time is specified as the number of 100 nanosecond intervals since
-        01/01/1601 00:00:00 UTC. It is stored as a 64 bit value. Python time libraries use
-        the format of seconds since 01/01/1970. '''
+# Windows NT time (FILETIME) is the number of 100 nanosecond intervals since 01/01/1601 00:00:00 UTC
+filetime_epoch = datetime(1601, 1, 1)
 
-    epoch_as_filetime = 116444736000000000
-    hundreds_of_ns = 10000000
+# Little-endian integers, read straight from the file content with unpack_from
+uint16_struct = struct.Struct('<H')
+uint32_struct = struct.Struct('<I')
+uint64_struct = struct.Struct('<Q')
 
-    # Convert to little endian before converting to int. Timestamp is a string containing a hex value.
-    # Split into a list (1 byte per element), reverse the list, and convert back to string.
-    timestamp_le = []
-    for offset in range(0, 16, 2):
-        timestamp_le.append(timestamp[offset:offset + 2])
-    timestamp_le = timestamp_le[::-1]
-    timestamp_le = ''.join(timestamp_le)
 
-    # Convert timestamp_le to int
-    timestamp_int = int(timestamp_le, 16)
-    # Make sure timestamp is not 0
-    # If 0, return 1/1/1970
-    # TODO: figure out why there are some 0 values
-    if timestamp_int != 0:
-        return(datetime.utcfromtimestamp((timestamp_int - epoch_as_filetime) / hundreds_of_ns))
-    else:
-        return(1) # Filler value
+def filetime_to_datetime(filetime):
+    ''' Convert a FILETIME int to a naive UTC datetime. A timestamp of 0 means the field was never set, so None is
+        returned, as it is for values too large for a datetime. '''
 
+    if filetime == 0:
+        return(None)
+    try:
+        return(filetime_epoch + timedelta(microseconds=filetime // 10))
+    except OverflowError:
+        return(None)
 
-def chunker(data, query_size, fillvalue='0'):
-    ''' Take a bytes object, return an iterable that will iterate in chunks of query_size. '''
 
-    args = [iter(data)] * query_size
-    return izip_longest(*args, fillvalue=fillvalue)
+def utf16_field(data):
+    ''' Decode a UTF-16LE string field. The string ends at the first NUL (00 00) that falls on a code unit
+        boundary; the padding after it is dropped. A leading BOM is removed. '''
 
+    end = data.find(b'\x00\x00')
+    # A match on an odd offset is the high byte of one code unit and the low byte of the next.
+    while end != -1 and end % 2:
+        end = data.find(b'\x00\x00', end + 1)
+    if end == -1:
+        end = len(data) - (len(data) % 2)
 
-def string_cleaner(data):
-    ''' The tbl file format has blocks allocated for string data. If the data doesn't fill the full block, it will be
-        padded with 00s. These 00s must be removed. Strip functions won't work because 00 is not a whitespace character. '''
+    text = data[:end].decode('utf-16-le', 'replace')
+    if text.startswith(u'\ufeff'):
+        text = text[1:]
+    return(text)
 
-    # Create a list to hold the data without the 00s.
-    data_clean = []
 
-    for chunk in chunker(data, 2):
-        if chunk != (0, 0):
-            data_clean.append(''.join(chunk[0]))
+def iter_batches(entries, batch_size):
+    ''' Split an iterable of entries into lists of at most batch_size entries. '''
 
-    # Convert the list back to a string
-    clean_data_str = ''.join(data_clean)  # Convert
-
-    # Return the string
-    return (clean_data_str)
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
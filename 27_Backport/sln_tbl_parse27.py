@@ -1,6 +1,23 @@
 import binascii
 from misc_functions27 import *
 
+
+# sln.tbl consists of 2,964-byte blocks beginning at offset 32. Each block starts with its length (0x0b94),
+# which doubles as the block signature.
+sln_block_size = 2964
+sln_block_signature = b'\x94\x0b\x00\x00'
+
+# Item type at bytes 1116 - 1119, as a 32-bit little-endian value
+sln_item_types = {0xffffffff: 'user_document', 0x00000009: 'application_dll'}
+
+# Location (start, stop) of the string fields within a block, by item type, in entry order:
+# doc_name, doc_path, doc_title, doc_author, addin_name, description. None for fields an item type does not have.
+sln_string_fields = {
+    'user_document':   ((48, 568), (568, 1088), (1144, 1402), (1402, 1672), None, None),
+    'application_dll': ((48, 568), (568, 1088), (1672, 1804), (2706, 2963), (1156, 1228), (2192, 2706)),
+}
+sln_string_fields['Unknown'] = sln_string_fields['user_document']
+
 class slnTable:
 
     def __init__(self, infile_content):
@@ -18,109 +35,59 @@ class slnTable:
 
     def parse_entries(self):
 
-        ''' Search the file for locations of table entries. '''
+        ''' Parse every table entry into self.entries. '''
+
+        for offset, entry in self.iter_entries():
+            self.entries[offset] = entry
+
+    def locate_blocks(self):
+
+        ''' Yield the offset of each table entry. Blocks are 2964 bytes long and laid out back to back from
+            offset 32, so the next block is expected one block length after the current one. If the signature
+            is not there (corrupted or unexpected data), search forward for the next one with find. A block cut
+            short by the end of the file is not yielded. '''
 
         doc_length = len(self.infile_content)
-        byte = 0
-
-        # Search through the file content in memory, looking for the table entries.
-        while(byte < doc_length):
-
-            # 1st byte should be 0x94. Binascii will return a string of the hex value
-            if binascii.hexlify(self.infile_content[byte]) == '94':
-
-                # test_block will be compared against the pattern header for table entries.
-                test_block = self.infile_content[byte:byte+4]
-
-                # If block matches,
-                if binascii.hexlify(test_block) == '940b0000':
-
-                    # The offset is the current byte number
-                    offset = byte
-                    self.entries[offset] = []
-
-                    # Item type is determined by bytes 1116 - 1119
-                    item_type = self.infile_content[byte+1116:byte+1120]
-                    found_item_type = False
-                    for key, value in self.item_type_dict.items():
-                        if binascii.hexlify(item_type) == value:
-                            self.entries[offset].append(key)
-                            found_item_type = True
-                    if not found_item_type:
-                        self.entries[offset].append('Unknown')
-
-                    # The docid is the 16 bytes after 0x940b
-                    self.entries[offset].append(binascii.hexlify(self.infile_content[byte+4:byte+20]))
-
-                    # The document name is bytes 48 - 567, encoded in UTF-16LE
-                    # Extra whitespace is removed.
-                    # In some cases, the doc_name is just a BOM with no additional text. These entries will be ignored for the time being.
-                    doc_name = self.infile_content[byte+48:byte+568]
-                    if binascii.hexlify(doc_name)[0:8] == 'fffe0000':
-                        del self.entries[offset]
-                        byte += 1
-                        continue
-                    # Remove trailing 00s from doc_name
-                    doc_name = string_cleaner(doc_name)
-                    self.entries[offset].append(doc_name)
-
-                    # The document path is bytes 568 - 1087. Because there could be any number of 00s at the end
-                    # of this segment, they need to be removed before converting to text.
-                    doc_path = self.infile_content[byte+568:byte+1088]
-                    # Remove trailing 00s from doc_path
-                    doc_path = string_cleaner(doc_path)
-                    self.entries[offset].append(doc_path)
-
-                    # The document title is bytes 1144 - 1401 for user documents, and
-                    # 1672-1804 for application dlls.
-                    if self.entries[offset][0] == 'application_dll':
-                        #doc_title = infile_content[byte+1156:byte+1402]
-                        doc_title = self.infile_content[byte+1672:byte+1804]
-                    else:
-                        doc_title = self.infile_content[byte+1144:byte+1402]
-                    if binascii.hexlify(doc_title)[0:8] != 'fffe0000':
-                        # Remove trailing 00s from doc_author
-                        doc_title = string_cleaner(doc_title)
-                        self.entries[offset].append(doc_title)
-                    else:
-                        self.entries[offset].append('')
-
-                    # The document author is bytes 1402 - 2192 for user documents, and
-                    # 2706 - 2963 for application dlls.
-                    # Make sure author is not blank before adding the to doc_authors list.
-                    if self.entries[offset][0] == 'application_dll':
-                        doc_author = self.infile_content[byte+2706:byte+2963]
-                    else:
-                        doc_author = self.infile_content[byte+1402:byte+1672]
-                    if binascii.hexlify(doc_author)[0:8] != 'fffe0000':
-                        # Remove trailing 00s from doc_author
-                        doc_author = string_cleaner(doc_author)
-                        self.entries[offset].append(doc_author)
-                    else:
-                        self.entries[offset].append('')
-
-                    # Application_dlls have an add-in name field between offsets 1156 - 1227
-                    if self.entries[offset][0] == 'application_dll':
-                        addin_name = self.infile_content[byte+1156:byte+1228]
-                        if binascii.hexlify(addin_name)[0:8] != 'fffe0000':
-                            # Remove trailing 00s from addin_name
-                            addin_name = string_cleaner(addin_name)
-                            self.entries[offset].append(addin_name)
-                        else:
-                            self.entries[offset].append('')
-                    else:
-                        self.entries[offset].append('')
-
-                    # Application_dlls also have descriptions between offsets 2192-2705
-                    if self.entries[offset][0] == 'application_dll':
-                        desc = self.infile_content[byte+2192:byte+2706]
-                        if binascii.hexlify(desc)[0:8] != 'fffe0000':
-                            # Remove trailing 00s from desc
-                            desc = string_cleaner(desc)
-                            self.entries[offset].append(desc)
-                        else:
-                            self.entries[offset].append('')
-                    else:
-                        self.entries[offset].append('')
-
-            byte += 1
+        byte = self.infile_content.find(sln_block_signature, 32)
+
+        while byte != -1 and byte + sln_block_size <= doc_length:
+            if self.infile_content[byte:byte+4] == sln_block_signature:
+                yield byte
+                byte += sln_block_size
+            else:
+                byte = self.infile_content.find(sln_block_signature, byte + 1)
+
+    def iter_entries(self):
+
+        ''' Generator yielding (offset, entry) for each table entry, in file order. Entries are lists in the
+            format of self.entries. '''
+
+        for byte in self.locate_blocks():
+
+            # The document name is bytes 48 - 567, encoded in UTF-16LE.
+            # In some cases, the doc_name is just a BOM with no additional text. These entries will be ignored for the time being.
+            if self.infile_content[byte+48:byte+52] == b'\xff\xfe\x00\x00':
+                continue
+
+            # Item type is determined by bytes 1116 - 1119
+            item_type = sln_item_types.get(uint32_struct.unpack_from(self.infile_content, byte + 1116)[0], 'Unknown')
+
+            # The docid is the 16 bytes after 0x940b
+            entry = [item_type, binascii.hexlify(self.infile_content[byte+4:byte+20])]
+
+            # The string fields of each item type: name, path, title, author, add-in name, description.
+            # Fields an item type does not have are blank.
+            for location in sln_string_fields[item_type]:
+                if location is None:
+                    entry.append(u'')
+                else:
+                    entry.append(utf16_field(self.infile_content[byte+location[0]:byte+location[1]]))
+
+            yield (byte, entry)
+
+    def iter_batches(self, batch_size=1000):
+
+        ''' Generator yielding lists of at most batch_size (offset, entry) pairs, so a caller (such as an Autopsy
+            ingest module) can process and commit the entries in chunks. '''
+
+        return(iter_batches(self.iter_entries(), batch_size))
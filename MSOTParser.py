@@ -1,176 +1,350 @@
 # TBL Parser
-# Arguments: sln.tbl path, evt.tbl path, output file (csv)
+# Arguments: sln.tbl path, evt.tbl path, user.tbl path, output file (csv)
 
+import re
 import sys
-import csv
+import argparse
+from datetime import datetime, timedelta
 from sln_tbl_parse import *
 from evt_tbl_parse import *
 from user_tbl_parse import *
-
-def check_args():
-
-    ''' Make sure that the correct number of arguments were passed to the script.
-        If not, display help and exit. '''
-
-    if len(sys.argv) != 5:
-
-        help_text = '\n\nMicrosoft Telemetry Parser.\nUsage: python telemparser.py input_sln_file input_evt_file input_user_file output_file.\n\nInput files should be Microsoft .tbl files. Output is csv.\n'
-        help_text += 'You MUST have an sln, evt, and user files for this parser to work.\n\n'
-        sys.exit(help_text)
+from tbl_report import *
+from tbl_batch import read_manifest, run_batch
+from tbl_cache import parseCache
+from tbl_discover import discover_profiles
+from tbl_sqlite import sqliteSink
+from tbl_tail import follow_profile
+from tbl_stats import tblStats, unknown_event_codes
+from tbl_open import tbl_table_classes
+from tbl_filter import tblFilter
+from tbl_timeline import run_timeline
+from tbl_snapshots import run_snapshots
+from tbl_sessions import iter_session_rows, sessionBuilder, session_header
+
+# --since and --until values: a date, then optionally a time (T or a space first), seconds, a fraction of a second
+# and a zone (Z, or an offset such as +02:00 or +0200)
+timestamp_pattern = re.compile(r'(\d{4}-\d{2}-\d{2})(?:[T ](\d{2}:\d{2})(:\d{2})?(\.\d{1,6})?'
+                               r'(Z|([+-])(\d{2}):?(\d{2}))?)?$', re.IGNORECASE)
+
+def parse_timestamp(value):
+
+    ''' argparse type for --since and --until: an ISO 8601 date or date and time. Times without a zone are UTC;
+        times with one (Z or e.g. +02:00) are converted to UTC. Returns a naive UTC datetime. '''
+
+    # Parsed by hand rather than with datetime.fromisoformat, which needs Python 3.7 (3.11 for a Z suffix)
+    match = timestamp_pattern.match(value)
+    try:
+        if match is None:
+            raise ValueError(value)
+        date, time, seconds, fraction, zone, sign, hours, minutes = match.groups()
+        timestamp = datetime.strptime(date + ' ' + (time or '00:00') + (seconds or ':00') + (fraction or '.0'),
+                                      '%Y-%m-%d %H:%M:%S.%f')
+        if sign is not None:
+            offset = timedelta(hours=int(hours), minutes=int(minutes))
+            if offset >= timedelta(days=1):
+                raise ValueError(zone)
+            timestamp -= offset if sign == '+' else -offset
+    except (ValueError, OverflowError):
+        raise argparse.ArgumentTypeError('invalid timestamp %r, expected e.g. 2017-03-01 or 2017-03-01T12:00:00' % value)
+
+    return(timestamp)
+
+
+def parse_event_ids(value):
+
+    ''' argparse type for --event-id: a comma separated list of event IDs. '''
+
+    try:
+        return([int(event_id) for event_id in value.split(',') if event_id.strip()])
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid event ID list %r' % value)
 
 
-def validate_tbl_format(infile_content):
-
-    ''' Validate file header of .tbl file. First 8 bytes must be 20 00 00 00 53 44 44 54.
-        Second 8 bytes determine which file (sln, etv, user). '''
-
-    tbl_type = '' # Will hold type of tbl file
-    byte = 0
-
-    # Grab the first 8 bytes of the file
-    test_block_1 = infile_content[0:8]
+def check_args():
 
-    # Header should be 2000000053444454
-    if test_block_1.hex() == '2000000053444454':
-        print('Valid .tbl file found. Checking tbl type...')
+    ''' Parse the arguments passed to the script. If they are incomplete, display help and exit. '''
+
+    parser = argparse.ArgumentParser(
+        prog='MSOTParser.py',
+        usage='%(prog)s [options] sln_file evt_file user_file output_file\n'
+              '       %(prog)s [options] --batch output_file [profile_dir ...] [--manifest FILE] [--discover ROOT]\n'
+              '       %(prog)s [options] --snapshots output_file snapshot_dir [snapshot_dir ...]',
+        description='Microsoft Telemetry Parser. Input files should be Microsoft .tbl files. Output is csv; use - as '
+                    'the output file to write to stdout.',
+        epilog='You MUST have an sln, evt, and user files for this parser to work. In batch mode, each profile_dir is '
+               'a Telemetry folder containing all three.')
+    parser.add_argument('paths', nargs='+', metavar='path', help=argparse.SUPPRESS)
+    parser.add_argument('--include-orphans', action='store_true',
+                        help='include evt entries whose docid is not in the sln table, with blank document fields')
+    parser.add_argument('--parse-workers', type=int, default=None, metavar='N',
+                        help='parse sln.tbl and evt.tbl across N worker processes (for very large files)')
+    parser.add_argument('--sessions', action='store_true',
+                        help='write one row per document session (load to close or crash) instead of one per event')
+    parser.add_argument('--format', choices=['csv', 'sqlite'], default=None,
+                        help='output format (default: sqlite if the output file ends in .db, .sqlite or .sqlite3, '
+                             'otherwise csv). SQLite output is appended to an existing database.')
+
+    filters = parser.add_argument_group('filters',
+                                        'Only report events that meet every condition given. Conditions are checked '
+                                        'before entries are decoded, so selective filters make large files faster.')
+    filters.add_argument('--since', type=parse_timestamp, metavar='TIMESTAMP',
+                         help='only events at or after TIMESTAMP (UTC unless a zone is given, e.g. 2017-03-01, '
+                              '2017-03-01T12:00:00 or 2017-03-01T14:00:00+02:00)')
+    filters.add_argument('--until', type=parse_timestamp, metavar='TIMESTAMP',
+                         help='only events at or before TIMESTAMP (UTC)')
+    filters.add_argument('--event-id', type=parse_event_ids, action='append', default=[], metavar='ID[,ID...]',
+                         help='only events with one of these event IDs, e.g. 11,12,16 for crashes (may be repeated)')
+    filters.add_argument('--item-type', action='append', choices=['user_document', 'application_dll', 'Unknown'],
+                         help='only events about documents of this item type (may be repeated)')
+    filters.add_argument('--path-prefix', metavar='PATH',
+                         help='only events about documents whose path starts with PATH (ignoring case)')
+
+    cache = parser.add_argument_group('parse cache')
+    cache.add_argument('--cache-dir', metavar='DIR',
+                       help='keep parsed sln.tbl and evt.tbl tables in DIR, so later runs over the same files skip '
+                            'parsing. Files are recognised by their size, modification time and content.')
+    cache.add_argument('--cache-size', type=float, default=1024, metavar='MB',
+                       help='with --cache-dir, evict the least recently used tables once the cache grows past MB '
+                            'megabytes (default: 1024)')
+
+    stats = parser.add_argument_group('statistics')
+    stats.add_argument('--stats', metavar='FILE',
+                       help='write the wall time, CPU time, bytes, records, skipped records and peak memory of each '
+                            'phase (read, validate, parse, join, write) to FILE, or - for stderr')
+    stats.add_argument('--stats-format', choices=['json', 'prometheus'], default=None,
+                       help='format of --stats (default: prometheus if FILE ends in .prom, otherwise json)')
+
+    follow = parser.add_argument_group('incremental mode')
+    follow.add_argument('--follow', metavar='CHECKPOINT',
+                        help='only parse evt.tbl blocks appended since the last run, as recorded in the CHECKPOINT '
+                             'file, and append their rows to the csv output. Falls back to a full parse if evt.tbl '
+                             'was truncated, rewritten or replaced.')
+    follow.add_argument('--interval', type=float, default=None, metavar='SECONDS',
+                        help='with --follow, keep polling every SECONDS seconds')
+
+    batch = parser.add_argument_group('batch mode')
+    batch.add_argument('--batch', action='store_true',
+                       help='parse many Telemetry folders in parallel into one report, with a Profile column')
+    batch.add_argument('--manifest', metavar='FILE',
+                       help='file listing Telemetry folders, one per line (implies --batch)')
+    batch.add_argument('--discover', action='append', default=[], metavar='ROOT',
+                       help='search the directory tree under ROOT (e.g. a mounted image) for Telemetry folders, '
+                            'identifying .tbl files by their header (implies --batch; may be repeated)')
+    batch.add_argument('--sniff-all', action='store_true',
+                       help='with --discover, check the header of every file, not only files named *.tbl')
+    batch.add_argument('--timeline', action='store_true',
+                       help='merge the rows of all profiles in timestamp order, rather than profile by profile')
+    batch.add_argument('--run-size', type=int, default=1000000, metavar='N',
+                       help='with --timeline, sort at most N events of a profile in memory at a time (default 1000000)')
+    batch.add_argument('--workers', type=int, default=None, metavar='N',
+                       help='number of worker processes (default: one per core)')
+
+    snapshots = parser.add_argument_group('snapshot mode')
+    snapshots.add_argument('--snapshots', action='store_true',
+                           help='report only the records added or removed between snapshots of one Telemetry folder '
+                                '(e.g. from shadow copies), given oldest first')
+
+    args = parser.parse_args()
+
+    if args.snapshots:
+        if args.batch or args.manifest or args.discover or args.follow:
+            parser.error('--snapshots cannot be combined with batch or incremental mode')
+        if len(args.paths) < 2:
+            parser.error('snapshot mode needs an output_file and at least one snapshot_dir')
+        args.output_file = args.paths[0]
+        args.profiles = args.paths[1:]
+    elif args.batch or args.manifest or args.discover:
+        args.batch = True
+        args.output_file = args.paths[0]
+        args.profiles = args.paths[1:]
+        if args.manifest:
+            args.profiles += read_manifest(args.manifest)
+        if not args.profiles and not args.discover:
+            parser.error('batch mode needs at least one profile_dir, a --manifest or --discover')
     else:
-        sys.exit('Invalid .tbl file!')
-
-    # Test the next 8 bytes to determine the type of .tbl file.
-    test_block_2 = infile_content[8:16]
-    if test_block_2.hex() == '01000000564e4953':
-        tbl_type = 'sln'
-        print('sln file detected.')
-    elif test_block_2.hex() == '01000000544e5645':
-        tbl_type = 'evt'
-        print('evt file detected.')
-    elif test_block_2.hex() == '0100000052455355':
-        tbl_type = 'user'
-        print('user file detected.')
-
-    return(tbl_type)
-
-
-def build_entry_dict(sln_table, evt_table):
-
-    ''' Build a dict from the entries parsed from sln_table and evt_table, to associate
-        each docid with the offsets of entries in both tables. '''
-
-    # docid_offsets is a dict with the format:
-    # docid : [[sln_table_offsets], [evt_table_offsets]]
-    docid_offsets = {}
-
-    # Build a list of unique docids from the sln table.
-    table_entries = set()
-    for entry in sln_table.entries:
-        table_entries.add(sln_table.entries[entry][1])
-
-    # Add the offsets from the sln table into docid_offsets
-    for entry in sln_table.entries:
-        if sln_table.entries[entry][1] not in docid_offsets:
-            # Add a new entry to docid_offsets. Add the value for this sln entry.
-            docid_offsets[sln_table.entries[entry][1]] = [[entry,],[]]
-        else:
-            # Append the value for this sln entry
-            # TODO: It doesn't appear the SLN table will contain duplicate DOCID entries.
-            docid_offsets[sln_table.entries[entry][1]][0].append(entry)
-
-    for entry in evt_table.entries:
-        if evt_table.entries[entry][4] not in docid_offsets:
-            print("DOCID %s found in evt table but not sln table!" % evt_table.entries[entry][4])
-        else:
-            docid_offsets[evt_table.entries[entry][4]][1].append(entry)
-
-    return(docid_offsets)
+        if len(args.paths) != 4:
+            parser.error('expected sln_file evt_file user_file output_file')
+        args.sln_file, args.evt_file, args.user_file, args.output_file = args.paths
+
+    if args.format is None:
+        args.format = 'sqlite' if args.output_file.lower().endswith(('.db', '.sqlite', '.sqlite3')) else 'csv'
+    if args.format == 'sqlite' and args.output_file == '-':
+        parser.error('SQLite output cannot be written to stdout')
+    if args.follow and (args.batch or args.format != 'csv'):
+        parser.error('--follow only supports a single profile with csv output')
+    if args.timeline and (not args.batch or args.format != 'csv'):
+        parser.error('--timeline only supports batch mode with csv output')
+    if args.sessions and (args.batch or args.follow or args.format != 'csv'):
+        parser.error('--sessions only supports a single profile with csv output')
+    if args.parse_workers and (args.batch or args.follow):
+        parser.error('--parse-workers only supports a single profile; batch mode already parses profiles in parallel')
+    if args.parse_workers and sys.version_info < (3, 8):
+        parser.error('--parse-workers needs Python 3.8 or later')
+    if args.stats and (args.batch or args.follow):
+        parser.error('--stats only supports a single profile')
+    args.filter = tblFilter(args.since, args.until, [event_id for event_ids in args.event_id for event_id in event_ids],
+                            args.item_type, args.path_prefix)
+    if not args.filter.active:
+        args.filter = None
+    if args.snapshots and (args.format != 'csv' or args.sessions or args.stats or args.parse_workers or args.filter):
+        parser.error('--snapshots only supports csv output, without --sessions, --stats, --parse-workers or filters')
+
+    if args.stats_format is None:
+        args.stats_format = 'prometheus' if (args.stats or '').endswith('.prom') else 'json'
+
+    return(args)
+
+
+def check_input(path, tbl_type):
+
+    ''' Exit with an error if the file at path is not a tbl_type table. Only the 16-byte header is read. Progress
+        is printed to stderr, so the report can be written to stdout. '''
+
+    try:
+        sniff_tbl_type(path, tbl_type)
+    except (OSError, tblFormatError) as error:
+        sys.exit('Invalid %s.tbl file! %s' % (tbl_type, error))
+    print('%s file detected.' % tbl_type, file=sys.stderr)
+
+
+def open_input(path, tbl_type, stats):
+
+    ''' Open one of the input tables as a tbl_type table, or exit with an error if it is not one (see
+        check_input). '''
+
+    with stats.phase('validate'):
+        check_input(path, tbl_type)
+
+    # Map the file into memory. Pages are only read from disk as the parser touches them.
+    with stats.phase('read'):
+        table = tbl_table_classes[tbl_type](open_tbl_buffer(path))
+    stats.count('read', nbytes=len(table.infile_content))
+    return(table)
 
 
 if __name__ == '__main__':
 
     # Check to make sure the appropriate number of arguments were provided.
-    check_args()
-
-    # Open the sln.tbl file in binary mode
-    sln_infile_name = sys.argv[1]
-    with open(sln_infile_name, 'rb') as infile:
-
-        # Read the file contents into memory
-        infile_content = infile.read()
-
-    # Validate that the  file is the correct format by checking the file header, else quit with error.
-    tbl_type = validate_tbl_format(infile_content)
-
-    if tbl_type == 'sln':
-        sln_table = slnTable(infile_content)
-        sln_table.parse_entries()
-    else:
-        sys.exit('Invalid sln.tbl file!')
-
-    # Open the evt.tbl file in binary mode
-    evt_infile_name = sys.argv[2]
-    with open(evt_infile_name, 'rb') as infile:
-
-        # Read the file contents into memory
-        infile_content = infile.read()
-
-    # Validate that the  file is the correct format by checking the file header, else quit with error.
-    tbl_type = validate_tbl_format(infile_content)
-
-    if tbl_type == 'evt':
-        evt_table = evtTable(infile_content)
-        evt_table.parse_entries()
-    else:
-        sys.exit('Invalid evt.tbl file!')
-
-    user_infile_name = sys.argv[3]
-    with open(user_infile_name, 'rb') as infile:
-
-        # Read the file contents into memory
-        infile_content = infile.read()
-
-    # Validate that the  file is the correct format by checking the file header, else quit with error.
-    tbl_type = validate_tbl_format(infile_content)
-
-    if tbl_type == 'user':
-        user_table = userTable(infile_content)
+    args = check_args()
+
+    if args.snapshots:
+        # Each snapshot is compared with the previous one. Exit with an error if any snapshot failed.
+        failed = run_snapshots(args.profiles, args.output_file, args.include_orphans)
+        sys.exit(1 if failed else 0)
+
+    if args.batch:
+        # Telemetry folders found by discovery are added to those given explicitly
+        for root in args.discover:
+            found = discover_profiles(root, sniff_all=args.sniff_all)
+            print('%d Telemetry folders found under %s' % (len(found), root), file=sys.stderr)
+            args.profiles += found
+
+        # Each profile is parsed in its own worker process. Exit with an error if any profile failed.
+        if args.timeline:
+            failed = run_timeline(args.profiles, args.output_file, args.workers, args.include_orphans, args.cache_dir,
+                                  int(args.cache_size * 1024 * 1024), args.filter, args.run_size)
+            sys.exit(1 if failed else 0)
+        failed = run_batch(args.profiles, args.output_file, args.workers, args.include_orphans, args.format,
+                           args.cache_dir, int(args.cache_size * 1024 * 1024), args.filter)
+        sys.exit(1 if failed else 0)
+
+    if args.follow:
+        # Incremental mode opens the files itself on every poll, and checks them again each time
+        check_input(args.sln_file, 'sln')
+        check_input(args.evt_file, 'evt')
+        check_input(args.user_file, 'user')
+        try:
+            follow_profile(args.sln_file, args.evt_file, args.user_file, args.output_file, args.follow,
+                           args.include_orphans, args.interval, args.filter)
+        except tblFormatError as error:
+            sys.exit('Invalid .tbl file! %s' % error)
+        sys.exit(0)
+
+    # Each phase is timed if --stats was given
+    stats = tblStats(enabled=bool(args.stats))
+
+    # Open the tables. Entries are parsed as the report is written.
+    sln_table = open_input(args.sln_file, 'sln', stats)
+    evt_table = open_input(args.evt_file, 'evt', stats)
+    user_table = open_input(args.user_file, 'user', stats)
+
+    with stats.phase('user.parse', len(user_table.infile_content)):
         user_table.parse_entries()
-        # Set some local references for the user data that will be added to the output file
-        user = user_table.entries[1]
-        host = user_table.entries[3] + "." + user_table.entries[4]
+    stats.count('user.parse', records=1)
+
+    sln_bytes = len(sln_table.infile_content)
+    evt_bytes = len(evt_table.infile_content)
+
+    # Parsed columns stand in for the tables when they are parsed in parallel or cached
+    parse_sln, parse_evt = sln_table.columns, evt_table.columns
+    if args.parse_workers:
+        # tbl_parallel needs Python 3.8 or later (multiprocessing.shared_memory), so it is only imported here
+        from tbl_parallel import parallel_columns
+        parse_sln = lambda: parallel_columns('sln', args.sln_file, args.parse_workers)
+        parse_evt = lambda: parallel_columns('evt', args.evt_file, args.parse_workers)
+
+    if args.cache_dir:
+        # The tables are only parsed if the cache doesn't have them yet
+        cache = parseCache(args.cache_dir, int(args.cache_size * 1024 * 1024))
+        with stats.phase('sln.parse'):
+            sln_table = cache.table('sln', args.sln_file, parse_sln)
+        with stats.phase('evt.parse'):
+            evt_table = cache.table('evt', args.evt_file, parse_evt)
+    elif args.parse_workers:
+        with stats.phase('sln.parse'):
+            sln_table = parse_sln()
+        with stats.phase('evt.parse'):
+            evt_table = parse_evt()
+
+    if args.filter is not None:
+        # Only the selected evt entries are passed on; they are decoded as they are read
+        with stats.phase('filter'):
+            evt_table = args.filter.apply(sln_table, evt_table)
+        print(args.filter.summary(), file=sys.stderr)
+
+    # The sln and evt tables are parsed as they are read by the join or the SQLite sink
+    stats.count('sln.parse', nbytes=sln_bytes)
+    stats.count('evt.parse', nbytes=evt_bytes)
+    sln_table = stats.instrument(sln_table, 'sln.parse')
+    evt_table = stats.instrument(evt_table, 'evt.parse')
+
+    if args.format == 'sqlite':
+        # Documents, events and the host are stored in their own tables; the join is left to queries
+        sink = sqliteSink(args.output_file)
+        with stats.phase('write'):
+            sink.write_profile(sln_table, evt_table, user_table)
+            sink.close()
+        print(sink.summary(), file=sys.stderr)
+        stats.count('write', records=sink.documents + sink.events)
+    elif args.sessions:
+        # The evt entries are sorted by document and time, then paired into sessions in one pass
+        join = docidIndex()
+        builder = sessionBuilder()
+        with stats.phase('write'):
+            rows = stats.timed(iter_session_rows(sln_table, evt_table, user_table, args.include_orphans, join, builder),
+                               'sessions')
+            write_csv_report(rows, args.output_file, columns=session_header)
+        print(join.summary(), file=sys.stderr)
+        print(builder.summary(), file=sys.stderr)
+        stats.count('write', records=stats.phases['sessions']['records'] if args.stats else 0)
+        stats.count('sessions', orphan_docid=sum(join.orphans.values()))
     else:
-        sys.exit('Invalid user.tbl file!')
-
-    # docid offsets will be a dict formatted as:
-    # docid : [[sln_table_offsets], [evt_table_offsets]]
-    docid_offsets = build_entry_dict(sln_table, evt_table)
-
-    # Create a 2 dimensional list to hold the final entries before writing to file.
-    # Each entry will be appended to this list as a sub-list.
-    results = []
-
-    for docid in docid_offsets:
-
-        # Get all the sln table values for this document
-        # Assume the SLN table does not contain duplicate entries for this.
-        doc_path   = sln_table.entries[docid_offsets[docid][0][0]][3] + "\\" + sln_table.entries[docid_offsets[docid][0][0]][2]
-        doc_id     = sln_table.entries[docid_offsets[docid][0][0]][1]
-        doc_type   = sln_table.entries[docid_offsets[docid][0][0]][0]
-        doc_title  = sln_table.entries[docid_offsets[docid][0][0]][4]
-        doc_author = sln_table.entries[docid_offsets[docid][0][0]][5]
-        addin_name = sln_table.entries[docid_offsets[docid][0][0]][6]
-        desc       = sln_table.entries[docid_offsets[docid][0][0]][7]
-
-        # Get the evt table values for this document. There can be multiple entries per docid.
-        for entry in range(len(docid_offsets[docid][1])):
-            timestamp  = evt_table.entries[docid_offsets[docid][1][entry]][5].strftime('%Y-%m-%d %H:%M:%S.%f')
-            entry_num  = evt_table.entries[docid_offsets[docid][1][entry]][0]
-            event_id   = evt_table.entries[docid_offsets[docid][1][entry]][2]
-            event_desc = evt_table.entries[docid_offsets[docid][1][entry]][3]
-            results.append([timestamp, entry_num, event_id, event_desc, doc_id, doc_title, doc_path, doc_type, doc_author, addin_name, desc, user, host])
-
-    with open(sys.argv[4], 'w', newline = '') as csvfile:
-        writer = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        # Write the header row
-        writer.writerow(['Timestamp','Entry #', 'Event ID', 'Event Description', 'Document ID', 'Document Title', 'Document Path', 'Document Type', 'Document Author', 'Add-in Name', 'Description'])
-        # Add all of the parsed results
-        for result in results:
-            writer.writerow(result)
+        # Join the tables and write each row as soon as it is produced
+        join = docidIndex()
+        with stats.phase('write'):
+            rows = stats.timed(iter_report_rows(sln_table, evt_table, user_table, args.include_orphans, join), 'join')
+            write_csv_report(rows, args.output_file)
+        print(join.summary(), file=sys.stderr)
+        stats.count('write', records=stats.phases['join']['records'] if args.stats else 0)
+        stats.count('join', orphan_docid=sum(join.orphans.values()))
+
+    # Parsed columns (cached or parsed in parallel) don't record this
+    if getattr(sln_table, 'truncated', 0):
+        print('%s ends with a partial block, which was left out' % args.sln_file, file=sys.stderr)
+
+    if args.stats:
+        # Columns loaded from the cache don't know how many blocks were skipped
+        if getattr(sln_table, 'skipped', None) is not None:
+            stats.count('sln.parse', bom_only_name=sln_table.skipped)
+        stats.count('evt.parse', unknown_event_code=unknown_event_codes(evt_table))
+        stats.write(args.stats, args.stats_format)
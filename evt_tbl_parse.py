@@ -1,80 +1,219 @@
+from collections.abc import Mapping
+
+import numpy as np
+
 from misc_functions import *
+from tbl_schema import evt_header_size, evt_block_size, evt_layout
+from tbl_records import evtRecord, evtColumns
+from tbl_index import evtQueries
+
+
+# The evt.tbl body is a fixed-stride array of 156-byte blocks beginning at offset 40.
+# evt_block_dtype describes a single block (see evt_layout in tbl_schema), so the whole
+# body can be mapped as one structured array.
+evt_block_dtype = evt_layout.dtype
+
+
+# dict containing definitions for the event_id codes. These are listed in full at:
+# https://msdn.microsoft.com/en-us/library/office/jj230106.aspx
+evt_event_codes = {
+    1: "Document loaded successfully",
+    2: "Document failed to load",
+    3: "Template loaded successfully",
+    4: "Template failed to load",
+    5: "Add-in loaded successfully",
+    6: "Add-in failed to load",
+    7: "Add-in manifest downloaded successfully",
+    8: "Add-in manifest did not download",
+    9: "Add-in manifest could not be parsed",
+    10:"Add-in used too much CPU",
+    11:"Application crashed on load",
+    12:"Application closed due to a problem",
+    13:"Document closed successfully",
+    14:"Application session extended",
+    15:"Add-in disabled due to string search time-out",
+    16:"Document open when applcation crashed",
+    17:"Add-in closed successfully",
+    18:"App closed successfully",
+    19:"Add-in encountered runtime error",
+    20:"Add-in failed to verify licensing"
+}
+
+
+class evtEntries(Mapping):
+
+    ''' Read-only, offset-keyed view over the columns of an evtTable. Provides the same
+        key: [entry_num, timestamp 1, event_id, event_desc, GUID, timestamp 2] layout as the
+        original dict of lists, as evtRecords, but each entry is only built when it is accessed. '''
+
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return(len(self.table.records))
+
+    def __iter__(self):
+        # Keys are the offset of the entry number field of each block, as before.
+        for index in range(self.table.first_block, self.table.first_block + len(self.table.records)):
+            yield evt_header_size + (index * evt_block_size) + 4
 
-class evtTable:
+    def __getitem__(self, offset):
+        # Like a dict, a key of any other type is simply not found
+        if not isinstance(offset, (int, np.integer)):
+            raise KeyError(offset)
+        index, remainder = divmod(offset - evt_header_size - 4, evt_block_size)
+        index -= self.table.first_block
+        if remainder != 0 or not 0 <= index < len(self.table.records):
+            raise KeyError(offset)
+
+        record = self.table.records[index]
+        event_id = int(record['event_id'])
+        return(evtRecord(int(record['entry_num']),
+                         filetime_to_datetime(int(record['timestamp_1'])),
+                         event_id,
+                         self.table.event_codes.get(event_id, 'Unknown'),
+                         bytes(record['guid']).hex(),
+                         filetime_to_datetime(int(record['timestamp_2']))))
+
+
+class evtTable(evtQueries):
 
     def __init__(self, infile_content):
-        self.infile_content = infile_content
+        # infile_content can be any buffer-protocol object. It is read through a memoryview, so slices do not copy.
+        self.infile_content = as_buffer(infile_content)
 
-        # dict containing information about each table entry
-        self.entries = {}
+        # Structured array (evt_block_dtype) over the body of the file. Filled by parse_entries.
+        self.records = np.zeros(0, dtype=evt_block_dtype)
+        # Number of the first block in self.records. Only non-zero when parsing starts part way into the file.
+        self.first_block = 0
+        self.parsed = False
+        # evtIndex over self.records, built by the first query (see tbl_index.evtQueries)
+        self.index = None
+
+        # Mapping containing information about each table entry
+        self.entries = evtEntries(self)
         # entries structure is:
             # key: offset
-            # value: list [entry_num,  timestamp 1, event_id, event_desc, GUID, timestamp 2]
-            #                 0            1          2         3          4         5
-
-        # dict containing definitions for the event_id codes. These are listed in full at:
-        # https://msdn.microsoft.com/en-us/library/office/jj230106.aspx
-        self.event_codes = {
-            1: "Document loaded successfully",
-            2: "Document failed to load",
-            3: "Template loaded successfully",
-            4: "Template failed to load",
-            5: "Add-in loaded successfully",
-            6: "Add-in failed to load",
-            7: "Add-in manifest downloaded successfully",
-            8: "Add-in manifest did not download",
-            9: "Add-in manifest could not be parsed",
-            10:"Add-in used too much CPU",
-            11:"Application crashed on load",
-            12:"Application closed due to a problem",
-            13:"Document closed successfully",
-            14:"Application session extended",
-            15:"Add-in disabled due to string search time-out",
-            16:"Document open when applcation crashed",
-            17:"Add-in closed successfully",
-            18:"App closed successfully",
-            19:"Add-in encountered runtime error",
-            20:"Add-in failed to verify licensing"
-        }
-
-    def parse_entries(self):
-
-        doc_length = len(self.infile_content)
-        byte = 40 # Start reading the evt file at the first entry
-
-        # Search through the file content in memory, looking for the table entries.
-        while(byte < doc_length):
-
-            # The first field is block length, which is always 156
-            # No need to store this field
-            offset = byte + 4
-            self.entries[offset] = []
-
-            # The entry number is the second byte
-            entry_num = self.infile_content[byte+4]
-            self.entries[offset].append(entry_num)
-
-            # Timestamp at offsets 24 - 31
-            timestamp = self.infile_content[byte+24:byte+32]
-            timestamp_hex = timestamp.hex()
-            self.entries[offset].append(convert_time(timestamp_hex))
-
-            # The event ID is at offset 36 (one byte)
-            event_id = self.infile_content[byte+36]
-            self.entries[offset].append(event_id)
-            # Event ID can be mapped to a text description in self.event_codes
-            if event_id in self.event_codes:
-                event_desc = self.event_codes[event_id]
-            else:
-                event_desc = 'Unknown'
-            self.entries[offset].append(event_desc)
-
-            # The GUID is offsets 40-55
-            self.entries[offset].append(self.infile_content[byte+40:byte+56].hex())
-
-            # Timestamp at offsets 136 - 143
-            timestamp = self.infile_content[byte+136:byte+144]
-            timestamp_hex = timestamp.hex()
-            self.entries[offset].append(convert_time(timestamp_hex))
-
-            byte += 156 # Jump to next entry
+            # value: evtRecord [entry_num,  timestamp 1, event_id, event_desc, GUID (docid), timestamp 2]
+            #                      0            1          2         3            4              5
+
+        # dict containing definitions for the event_id codes
+        self.event_codes = evt_event_codes
+
+    def parse_entries(self, start_offset=evt_header_size):
+
+        ''' Map the body of the file as a structured array of evt blocks. No data is copied;
+            the columns below are views into infile_content. Blocks before start_offset
+            (which must be on a block boundary) are skipped. '''
+
+        if start_offset < evt_header_size or (start_offset - evt_header_size) % evt_block_size:
+            raise ValueError('start_offset %d is not on an evt block boundary' % start_offset)
+
+        # Any trailing partial block is ignored.
+        block_count = max(len(self.infile_content) - start_offset, 0) // evt_block_size
+        self.records = np.frombuffer(self.infile_content, dtype=evt_block_dtype,
+                                     count=block_count, offset=min(start_offset, len(self.infile_content)))
+        self.first_block = (start_offset - evt_header_size) // evt_block_size
+        self.parsed = True
+        self.index = None
+
+    @property
+    def end_offset(self):
+        ''' Offset just past the last parsed block, where the next appended block will start. '''
+        return(evt_header_size + (self.first_block + len(self.records)) * evt_block_size)
+
+    def iter_entries(self, chunk_size=65536):
+
+        ''' Generator yielding (offset, entry) for each block, in file order. Entries have the same layout as
+            self.entries values. The columns are converted chunk_size blocks at a time. '''
+
+        if not self.parsed:
+            self.parse_entries()
+
+        for start in range(0, len(self.records), chunk_size):
+            stop = min(start + chunk_size, len(self.records))
+
+            # NaT (unset timestamps) converts to None
+            columns = zip(self.entry_nums[start:stop].tolist(),
+                          self.datetimes_1(start, stop).astype(object),
+                          self.event_ids[start:stop].tolist(),
+                          self.event_descriptions(start, stop),
+                          self.guid_hex(start, stop),
+                          self.datetimes_2(start, stop).astype(object))
+
+            for offset, entry in zip(self.offsets[start:stop].tolist(), columns):
+                yield (offset, evtRecord._make(entry))
+
+    def columns(self):
+
+        ''' Copy the parsed fields into a compact evtColumns container, which does not reference infile_content. '''
+
+        if not self.parsed:
+            self.parse_entries()
+
+        return(evtColumns(self.offsets, self.entry_nums, self.timestamps_1, self.event_ids, self.guids,
+                          self.timestamps_2, self.event_codes))
+
+    def take(self, indices):
+
+        ''' Copy only the entries selected by indices (an index array or boolean mask over the parsed blocks) into
+            an evtColumns container. Nothing is decoded. '''
+
+        if not self.parsed:
+            self.parse_entries()
+
+        return(evtColumns(self.offsets[indices], self.entry_nums[indices], self.timestamps_1[indices],
+                          self.event_ids[indices], self.guids[indices], self.timestamps_2[indices], self.event_codes))
+
+    # Whole-column accessors. Methods taking start and stop return the column for that range of blocks.
+
+    @property
+    def offsets(self):
+        ''' Offset of the entry number field of each block (the key used by self.entries). '''
+        return((np.arange(len(self.records), dtype=np.int64) + self.first_block) * evt_block_size + evt_header_size + 4)
+
+    @property
+    def entry_nums(self):
+        return(self.records['entry_num'])
+
+    @property
+    def event_ids(self):
+        return(self.records['event_id'])
+
+    @property
+    def timestamps_1(self):
+        ''' Raw FILETIME values from offset 24 of each block. '''
+        return(self.records['timestamp_1'])
+
+    @property
+    def timestamps_2(self):
+        ''' Raw FILETIME values from offset 136 of each block. '''
+        return(self.records['timestamp_2'])
+
+    def datetimes_1(self, start=0, stop=None):
+        ''' Timestamps from offset 24 of each block as a datetime64[us] array. '''
+        return(filetimes_to_datetime64(self.timestamps_1[start:stop]))
+
+    def datetimes_2(self, start=0, stop=None):
+        ''' Timestamps from offset 136 of each block as a datetime64[us] array. '''
+        return(filetimes_to_datetime64(self.timestamps_2[start:stop]))
+
+    @property
+    def guids(self):
+        ''' Document GUIDs as a 16-byte void column. '''
+        return(self.records['guid'])
+
+    # Same name as the evtColumns field
+    docids = guids
+
+    def guid_hex(self, start=0, stop=None):
+        ''' Return the document GUIDs as a list of hex strings, in block order. '''
+        guid_hex = self.guids[start:stop].tobytes().hex()
+        return([guid_hex[pos:pos + 32] for pos in range(0, len(guid_hex), 32)])
+
+    def event_descriptions(self, start=0, stop=None):
+        ''' Return the description of every event code, in block order. '''
+        lookup = np.array(['Unknown'] + [self.event_codes[code] for code in sorted(self.event_codes)], dtype=object)
+        codes = self.event_ids[start:stop].astype(np.int64)
+        codes[(codes < 1) | (codes > len(self.event_codes))] = 0
+        return(lookup[codes])
@@ -4,58 +4,189 @@
 #
 ###############################################################################
 
-from datetime import datetime, timedelta
-from itertools import zip_longest
+import mmap
+from datetime import datetime, timedelta, timezone
 
+import numpy as np
+
+from tbl_schema import tbl_header_size, tbl_signature, tbl_type_signatures
+
+
+# Windows NT time (FILETIME) is specified as the number of 100 nanosecond intervals since
+# 01/01/1601 00:00:00 UTC. It is stored as a 64 bit little-endian value.
+filetime_epoch = datetime(1601, 1, 1)
+# Largest FILETIME that can be represented by a datetime (9999-12-31 23:59:59.999999)
+filetime_max = (datetime.max - filetime_epoch) // timedelta(microseconds=1) * 10 + 9
+# Offset between the FILETIME epoch and the Unix epoch, in microseconds
+epoch_as_filetime_us = 11644473600000000
+
+
+def filetime_to_datetime(filetime):
+    ''' Convert a FILETIME int to a naive UTC datetime. The conversion is done in integer microseconds, so
+        no precision is lost to floating point. A timestamp of 0 means the field was never set, so None is
+        returned. None is also returned for values too large for a datetime, which only occur in corrupted blocks. '''
 
-def convert_time(timestamp):
-    ''' Windows NT time is specified as the number of 100 nanosecond intervals since
-        01/01/1601 00:00:00 UTC. It is stored as a 64 bit value. Python time libraries use
-        the format of seconds since 01/01/1970. '''
-
-    epoch_as_filetime = 116444736000000000
-    hundreds_of_ns = 10000000
-
-    # Convert to little endian before converting to int. Timestamp is a string containing a hex value.
-    # Split into a list (1 byte per element), reverse the list, and convert back to string.
-    timestamp_le = []
-    for offset in range(0, 16, 2):
-        timestamp_le.append(timestamp[offset:offset + 2])
-    timestamp_le = timestamp_le[::-1]
-    timestamp_le = ''.join(timestamp_le)
-
-    # Convert timestamp_le to int
-    timestamp_int = int(timestamp_le, 16)
-    # Make sure timestamp is not 0
-    # If 0, return 1/1/1970
     # TODO: figure out why there are some 0 values
-    if timestamp_int != 0:
-        return(datetime.utcfromtimestamp((timestamp_int - epoch_as_filetime) / hundreds_of_ns))
-    else:
-        return(1) # Filler value
+    if filetime == 0 or filetime > filetime_max:
+        return(None)
+
+    return(filetime_epoch + timedelta(microseconds=filetime // 10))
+
+
+def datetime_to_filetime(timestamp):
+    ''' Convert a datetime to a FILETIME int. Naive datetimes are taken to be UTC; aware ones are converted. '''
+
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return((timestamp - filetime_epoch) // timedelta(microseconds=1) * 10)
+
+
+def filetimes_to_datetime64(filetimes):
+    ''' Convert an array of FILETIME values to a datetime64[us] array in one step. As with filetime_to_datetime,
+        zero and out of range timestamps become NaT. '''
+
+    filetimes = np.asarray(filetimes, dtype=np.uint64)
+
+    # Work in microseconds since the Unix epoch, which is what datetime64[us] stores.
+    microseconds = (filetimes // 10).astype(np.int64) - epoch_as_filetime_us
+    converted = microseconds.view('datetime64[us]')
+    converted[(filetimes == 0) | (filetimes > filetime_max)] = np.datetime64('NaT')
+
+    return(converted)
+
+
+def convert_time(timestamp):
+    ''' Convert a FILETIME given as a hex string of its 8 bytes (as stored in the file, little-endian)
+        to a datetime. Returns None for a zero timestamp. '''
+
+    return(filetime_to_datetime(int.from_bytes(bytes.fromhex(timestamp), byteorder='little')))
+
+
+def utf16_terminate(data):
+    ''' The tbl file format has blocks allocated for string data. If the data doesn't fill the full block, it is
+        terminated by a UTF-16 NUL (00 00) and padded. Return the bytes of the string up to the first NUL that falls
+        on a code unit boundary. '''
+
+    data = bytes(data)
+
+    end = data.find(b'\x00\x00')
+    # A match on an odd offset is the high byte of one code unit and the low byte of the next.
+    while end != -1 and end % 2:
+        end = data.find(b'\x00\x00', end + 1)
+
+    if end != -1:
+        return(data[:end])
+    # No terminator. Drop any dangling byte from fields with an odd length.
+    return(data[:len(data) - (len(data) % 2)])
+
+
+def decode_utf16(data):
+    ''' Decode a single UTF-16LE string field, cut at its NUL terminator. A leading BOM is removed. '''
+
+    text = utf16_terminate(data).decode('utf-16-le', 'replace')
+    if text.startswith('\ufeff'):
+        text = text[1:]
+    return(text)
+
+
+def decode_utf16_column(fields):
+    ''' Decode a column of UTF-16LE string fields (any iterable of bytes-like objects) in one batch. Each field is cut
+        at its terminator, the fields are joined with NUL separators and the whole column is decoded with a single
+        decode call. Returns a list of strings in the same order as fields. '''
+
+    terminated = [utf16_terminate(field) for field in fields]
+    if not terminated:
+        return([])
+
+    column = b'\x00\x00'.join(terminated).decode('utf-16-le', 'replace').split('\x00')
+    return([text[1:] if text.startswith('\ufeff') else text for text in column])
+
+
+class tblFormatError(ValueError):
+    ''' Raised when a file is not the .tbl file it is expected to be. '''
+
+
+class tblSignatureError(tblFormatError):
+    ''' Raised when a file does not start with the .tbl signature. '''
+
+
+class tblTypeError(tblFormatError):
+    ''' Raised when a .tbl file is of an unknown type, or not of the expected type. '''
+
+
+# TBL files start with a 16-byte header (see tbl_schema). The first 8 bytes are common to all
+# TBL files, the second 8 bytes identify the table.
+def get_tbl_type(header):
+    ''' Identify a .tbl file from (at least) its first 16 bytes. Returns 'sln', 'evt' or 'user', '' for a .tbl
+        file of an unknown type, or None if the signature does not match. '''
+
+    if bytes(header[0:8]) != tbl_signature:
+        return(None)
+    return(tbl_type_signatures.get(bytes(header[8:16]), ''))
+
+
+def read_tbl_header(path):
+    ''' Read the 16-byte header of a file, and nothing else. Returns fewer bytes if the file is shorter. '''
+
+    with open(path, 'rb') as infile:
+        return(infile.read(tbl_header_size))
+
+
+def sniff_tbl_type(path, expected_type=None):
+    ''' Return the type ('sln', 'evt' or 'user') of the .tbl file at path, reading only its header. Raises
+        tblSignatureError if it is not a .tbl file, tblTypeError if its type is unknown or is not expected_type,
+        and OSError if it cannot be read. '''
+
+    header = read_tbl_header(path)
+    tbl_type = get_tbl_type(header)
+
+    if tbl_type is None or len(header) < tbl_header_size:
+        raise tblSignatureError('%s is not a .tbl file' % path)
+    if not tbl_type:
+        raise tblTypeError('%s is a .tbl file of unknown type' % path)
+    if expected_type is not None and tbl_type != expected_type:
+        raise tblTypeError('%s is not a %s.tbl file (its header is that of %s.tbl)' % (path, expected_type, tbl_type))
+    return(tbl_type)
 
 
-def chunker(data, query_size, fillvalue='0'):
-    ''' Take a bytes object, return an iterable that will iterate in chunks of query_size. '''
+def open_tbl_buffer(path, use_mmap=True):
+    ''' Open a .tbl file for parsing. By default the file is memory-mapped read-only, so it is paged in on
+        demand and the page cache is shared with any other process reading the same file. With use_mmap=False
+        the whole file is read into a bytes object instead. '''
 
-    args = [iter(data)] * query_size
-    return zip_longest(*args, fillvalue=fillvalue)
+    with open(path, 'rb') as infile:
+        if use_mmap:
+            try:
+                # The mapping stays valid after the file object is closed.
+                return(mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ))
+            except ValueError:
+                # Empty files cannot be mapped.
+                pass
+        return(infile.read())
 
 
-def string_cleaner(data):
-    ''' The tbl file format has blocks allocated for string data. If the data doesn't fill the full block, it will be
-        padded with 00s. These 00s must be removed. Strip functions won't work because 00 is not a whitespace character. '''
+def as_buffer(content):
+    ''' Return a flat, zero-copy memoryview of any buffer-protocol object (bytes, bytearray, mmap, array...). '''
 
-    # Create a list to hold the data without the 00s.
-    data_clean = []
+    view = memoryview(content)
+    if view.ndim != 1 or view.format != 'B':
+        view = view.cast('B')
+    return(view)
 
-    for chunk in chunker(data, 2):
-        if chunk != (0, 0):
-            data_clean.append(chr(chunk[0]))
 
-    # Convert the list back to a string
-    clean_data_str = ''.join(data_clean)  # Convert
+def find_bytes(content, sub, start=0, window=1 << 20):
+    ''' Equivalent of content.find(sub, start) for any buffer. bytes, bytearray and mmap objects are searched with
+        their own find. Other buffers are searched through a sliding window, so at most window bytes are copied at a time. '''
 
-    # Return the string
-    return (clean_data_str)
+    if hasattr(content, 'find'):
+        return(content.find(sub, start))
 
+    view = as_buffer(content)
+    overlap = len(sub) - 1
+    while start < len(view):
+        chunk = bytes(view[start:start + window + overlap])
+        found = chunk.find(sub)
+        if found != -1:
+            return(start + found)
+        start += window
+    return(-1)
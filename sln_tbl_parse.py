@@ -1,139 +1,208 @@
+import struct
+
 from misc_functions import *
+from tbl_schema import sln_header_size, sln_block_size, sln_block_signature, sln_layouts, sln_item_types
+from tbl_records import slnRecord, slnColumns
+
+
+# sln.tbl consists of 2,964-byte blocks beginning at offset 32; the block layouts are declared in tbl_schema.
+
+# Location of the UTF-16LE string fields within a block, by item type. Fields an item type does not have are blank.
+sln_string_fields = {item_type: layout.strings for item_type, layout in sln_layouts.items()}
+
+# The same locations as a tuple in slnRecord field order (doc_name onwards), None for fields an item type does not have
+sln_string_slices = {item_type: tuple(layout.strings.get(name) for name in slnRecord._fields[2:])
+                     for item_type, layout in sln_layouts.items()}
+
+# The item type is a 32-bit little-endian value at the same offset in every layout
+sln_item_type_offset = sln_layouts['Unknown'].fields['item_type'][1]
+sln_item_type_struct = struct.Struct('<I')
+
+
+def _lazy_field(name):
+    ''' Property that decodes string field name of an slnLazyRecord on first access. '''
+    return(property(lambda self: self.decode(name), doc='%s, decoded on first access' % name))
+
+
+class slnLazyRecord:
+
+    ''' View of one sln.tbl entry that only decodes the item type and docid up front. The string fields are
+        decoded from the underlying block when first read and then cached. Reads the same as an slnRecord:
+        by name (entry.doc_path) or by index (entry[3]). '''
+
+    __slots__ = ('block', 'item_type', 'docid', '_doc_name', '_doc_path', '_doc_title', '_doc_author',
+                 '_addin_name', '_description')
+
+    def __init__(self, block, item_type, docid):
+        # block is a memoryview of the whole block
+        self.block = block
+        self.item_type = item_type
+        self.docid = docid
+        for name in slnRecord._fields[2:]:
+            setattr(self, '_' + name, None)
+
+    def decode(self, name):
+        ''' Return string field name, decoding it on first access. '''
+        value = getattr(self, '_' + name)
+        if value is None:
+            location = sln_string_fields[self.item_type].get(name)
+            value = decode_utf16(self.block[location[0]:location[1]]) if location is not None else ''
+            setattr(self, '_' + name, value)
+        return(value)
+
+    doc_name = _lazy_field('doc_name')
+    doc_path = _lazy_field('doc_path')
+    doc_title = _lazy_field('doc_title')
+    doc_author = _lazy_field('doc_author')
+    addin_name = _lazy_field('addin_name')
+    description = _lazy_field('description')
+
+    def __len__(self):
+        return(len(slnRecord._fields))
+
+    def __iter__(self):
+        for name in slnRecord._fields:
+            yield getattr(self, name)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return(tuple(self)[index])
+        return(getattr(self, slnRecord._fields[index]))
+
+    def __eq__(self, other):
+        if isinstance(other, (tuple, slnLazyRecord)):
+            return(tuple(self) == tuple(other))
+        return(NotImplemented)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return('slnLazyRecord(item_type=%r, docid=%r)' % (self.item_type, self.docid))
+
+    def record(self):
+        ''' Decode every field and return them as an slnRecord. '''
+        return(slnRecord._make(self))
+
 
 class slnTable:
 
     def __init__(self, infile_content):
-        self.infile_content = infile_content
+        # infile_content can be any buffer-protocol object. It is read through a memoryview, so slices do not copy.
+        self.infile_content = as_buffer(infile_content)
+        # The original object is kept for its native find(), where it has one.
+        self.source = infile_content
  
         # dict containing information about each table entry
         self.entries = {}
         # entries structure is:
             # key: offset
-            # value: list [type, doc_id,doc_name, doc_path, doc_title, doc_author, addin_name, description]
-            #                 0     1      2         3         4          5             6           7
+            # value: slnRecord [type, doc_id,doc_name, doc_path, doc_title, doc_author, addin_name, description]
+            #                    0     1      2         3         4          5             6           7
 
-        # dict containing pattern matches for entry types
-        self.item_type_dict = {'user_document':'ffffffff', 'application_dll':'09000000'}
+        # Number of blocks skipped by the last iter_entries pass (name is only a BOM)
+        self.skipped = 0
+        # 1 if the last locate_blocks pass found a block cut short by the end of the file
+        self.truncated = 0
+
+    def locate_blocks(self):
+
+        ''' Yield the offset of each table entry. Blocks are laid out back to back from offset 32, so
+            the next block is expected one block length after the current one. If the signature is not
+            there (corrupted or unexpected data), search forward for the next signature to resync.
+            A block cut short by the end of the file (e.g. a truncated or carved copy) is not yielded; it is
+            counted in self.truncated instead. '''
 
-    def parse_entries(self):
-    
-        ''' Search the file for locations of table entries. ''' 
-        
         doc_length = len(self.infile_content)
-        byte = 0
-
-        # Search through the file content in memory, looking for the table entries.
-        while(byte < doc_length):
-
-            # 1st byte should be 0x94
-            if hex(self.infile_content[byte]) == '0x94':
-        
-                # test_block will be compared against the pattern header for table entries.
-                test_block = self.infile_content[byte:byte+4]
-
-                # If block matches, 
-                if test_block.hex() == '940b0000':
-
-                    # The offset is the current byte number
-                    offset = byte
-                    self.entries[offset] = []
-                
-                    # Item type is determined by bytes 1116 - 1119
-                    item_type = self.infile_content[byte+1116:byte+1120]
-                    found_item_type = False
-                    for key, value in self.item_type_dict.items():
-                        if item_type.hex() == value:
-                            self.entries[offset].append(key)
-                            found_item_type = True
-                    if not found_item_type:
-                        self.entries[offset].append('Unknown')
-                
-                    # The docid is the 16 bytes after 0x940b
-                    self.entries[offset].append(self.infile_content[byte+4:byte+20].hex())
-                
-                    # The document name is bytes 48 - 567, encoded in UTF-16LE
-                    # Extra whitespace is removed.
-                    # In some cases, the doc_name is just a BOM with no additional text. These entries will be ignored for the time being.
-                    doc_name = self.infile_content[byte+48:byte+568]
-                    if doc_name.hex()[0:8] == 'fffe0000':
-                        del self.entries[offset]
-                        byte += 1
-                        continue
-                    # Remove trailing 00s from doc_name
-                    doc_name = string_cleaner(doc_name)
-                    self.entries[offset].append(doc_name)
-   
-                    # The document path is bytes 568 - 1087. Because there could be any number of 00s at the end
-                    # of this segment, they need to be removed before converting to text.
-                    doc_path = self.infile_content[byte+568:byte+1088]
-                    # Remove trailing 00s from doc_path
-                    doc_path = string_cleaner(doc_path)
-                    self.entries[offset].append(doc_path)
-                
-                    # The document title is bytes 1144 - 1401 for user documents, and
-                    # 1672-1804 for application dlls.
-                    if self.entries[offset][0] == 'application_dll':
-                        #doc_title = infile_content[byte+1156:byte+1402]
-                        doc_title = self.infile_content[byte+1672:byte+1804]
-                    else:
-                        doc_title = self.infile_content[byte+1144:byte+1402]
-                    if doc_title.hex()[0:8] != 'fffe0000':
-                        # Remove trailing 00s from doc_author
-                        doc_title = string_cleaner(doc_title)
-                        self.entries[offset].append(doc_title)
-                    else:
-                        self.entries[offset].append('')
-                
-                    # The document author is bytes 1402 - 2192 for user documents, and
-                    # 2706 - 2963 for application dlls.
-                    # Make sure author is not blank before adding the to doc_authors list.
-                    if self.entries[offset][0] == 'application_dll':
-                        doc_author = self.infile_content[byte+2706:byte+2963]
-                    else:
-                        doc_author = self.infile_content[byte+1402:byte+1672]
-                    if doc_author.hex()[0:8] != 'fffe0000':
-                        # Remove trailing 00s from doc_author
-                        doc_author = string_cleaner(doc_author)
-                        self.entries[offset].append(doc_author)
-                    else:
-                        self.entries[offset].append('')
-                
-                    # Application_dlls have an add-in name field between offsets 1156 - 1227
-                    if self.entries[offset][0] == 'application_dll':
-                        addin_name = self.infile_content[byte+1156:byte+1228]
-                        if addin_name.hex()[0:8] != 'fffe0000':
-                            # Remove trailing 00s from addin_name
-                            addin_name = string_cleaner(addin_name)
-                            self.entries[offset].append(addin_name)
-                        else:
-                            self.entries[offset].append('')
-                    else:
-                        self.entries[offset].append('')
-                
-                    # Application_dlls also have descriptions between offsets 2192-2705
-                    if self.entries[offset][0] == 'application_dll':
-                        desc = self.infile_content[byte+2192:byte+2706]
-                        if desc.hex()[0:8] != 'fffe0000':
-                            # Remove trailing 00s from desc
-                            desc = string_cleaner(desc)
-                            self.entries[offset].append(desc)
-                        else:
-                            self.entries[offset].append('')
-                    else:
-                        self.entries[offset].append('')
-
-                
-                # Print some results to the screen        
-                #print("Found table entry at offset %d" % offset)
-                #print("Item Type = %s" % self.entries[offset][0])
-                #print("DocID = %s" % self.entries[offset][1])
-                #print("Document = %s\\%s" % (self.entries[offset][3], self.entries[offset][2]))
-                #print("Title = %s" % self.entries[offset][4])
-                #print("Add-In Name = %s" % self.entries[offset][6])
-                #print("Author = %s" % self.entries[offset][5])
-                #print("Description = %s" % self.entries[offset][7])
-                #print("\n")
-            
-            byte += 1    
+        byte = sln_header_size
+        self.truncated = 0
+
+        while byte + sln_block_size <= doc_length:
+
+            if self.infile_content[byte:byte+4] == sln_block_signature:
+                yield byte
+                byte += sln_block_size
+            else:
+                byte = find_bytes(self.source, sln_block_signature, byte + 1)
+                if byte == -1:
+                    return
+
+        if self.infile_content[byte:byte+4] == sln_block_signature:
+            self.truncated = 1
 
+    def parse_entries(self):
     
+        ''' Parse every table entry into self.entries. '''
+
+        for offset, entry in self.iter_entries():
+            self.entries[offset] = entry
+
+    def columns(self):
+
+        ''' Parse every table entry into a column-oriented slnColumns container. '''
+
+        columns = slnColumns.from_entries(self.iter_entries())
+        columns.skipped = self.skipped
+        return(columns)
+
+    def item_type_at(self, byte):
+
+        ''' Return the item type of the block at byte. The item type is determined by bytes 1116 - 1119. '''
+
+        item_type = sln_item_type_struct.unpack_from(self.infile_content, byte + sln_item_type_offset)[0]
+        return(sln_item_types.get(item_type, 'Unknown'))
+
+    def iter_entries(self, batch_size=1024, lazy=False, offsets=None):
+
+        ''' Generator yielding (offset, entry) for each table entry found by locate_blocks, in file order.
+            Entries are slnRecords, as in self.entries. Blocks are parsed batch_size at a time. With lazy=True
+            entries are slnLazyRecords instead, which only decode their string fields when they are read.
+            offsets can be given to parse only those blocks (as found by locate_blocks). '''
+
+        self.skipped = 0
+        if offsets is None:
+            offsets = self.locate_blocks()
+
+        if lazy:
+            for byte in offsets:
+                # Entries whose name is just a BOM are ignored, as below.
+                if self.infile_content[byte+48:byte+52].hex() == 'fffe0000':
+                    self.skipped += 1
+                    continue
+                block = self.infile_content[byte:byte+sln_block_size]
+                yield (byte, slnLazyRecord(block, self.item_type_at(byte), block[4:20].hex()))
+            return
+
+        # The string fields of each block are collected while walking the blocks, using the layout of the
+        # block's item type, and decoded as one column per field for each batch.
+        batch = []
+        columns = [[] for name in slnRecord._fields[2:]]
+
+        for byte in offsets:
+
+            # The document name is bytes 48 - 567. In some cases, the doc_name is just a BOM
+            # with no additional text. These entries will be ignored for the time being.
+            if self.infile_content[byte+48:byte+52].hex() == 'fffe0000':
+                self.skipped += 1
+                continue
+
+            # The docid is the 16 bytes after 0x940b
+            item_type = self.item_type_at(byte)
+            batch.append((byte, item_type, self.infile_content[byte+4:byte+20].hex()))
+
+            for column, location in zip(columns, sln_string_slices[item_type]):
+                column.append(self.infile_content[byte+location[0]:byte+location[1]] if location is not None else b'')
+
+            if len(batch) == batch_size:
+                yield from self._finish_batch(batch, columns)
+                batch = []
+                columns = [[] for name in slnRecord._fields[2:]]
+
+        yield from self._finish_batch(batch, columns)
+
+    def _finish_batch(self, batch, columns):
+
+        ''' Decode each string column of a batch of entries in one call, then yield the entries. '''
+
+        decoded = [decode_utf16_column(column) for column in columns]
+        for (offset, item_type, docid), fields in zip(batch, zip(*decoded)):
+            yield (offset, slnRecord(item_type, docid, *fields))
@@ -0,0 +1,167 @@
+###############################################################################
+#
+# Batch mode for libmsot: parse the Telemetry folders of many user profiles
+# in parallel and merge them into one report.
+#
+###############################################################################
+
+import csv
+import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from sln_tbl_parse import *
+from evt_tbl_parse import *
+from user_tbl_parse import *
+from tbl_join import docidIndex
+from tbl_report import *
+from tbl_sqlite import sqliteSink
+from tbl_cache import parseCache
+from tbl_open import open_tbl
+
+
+# Batch reports have one extra column, holding the Telemetry folder each row was parsed from.
+# The user and host columns of the regular report identify the profile and machine.
+batch_header = report_header + ['Profile']
+
+# File names of the tables in a Telemetry folder
+profile_file_names = {'sln': 'sln.tbl', 'evt': 'evt.tbl', 'user': 'user.tbl'}
+
+
+def read_manifest(manifest_path):
+    ''' Read a manifest of Telemetry folders, one per line. Blank lines and lines starting with # are ignored. '''
+
+    directories = []
+    with open(manifest_path, 'r') as manifest:
+        for line in manifest:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                directories.append(line)
+    return(directories)
+
+
+def find_profile_files(directory):
+    ''' Return a dict of tbl type : path for the sln, evt and user tables in a Telemetry folder. File names are
+        matched case-insensitively. Raises FileNotFoundError if any of the three is missing. '''
+
+    names = {name.lower(): name for name in os.listdir(directory)}
+
+    profile_files = {}
+    for tbl_type, file_name in profile_file_names.items():
+        if file_name not in names:
+            raise FileNotFoundError('%s not found in %s' % (file_name, directory))
+        profile_files[tbl_type] = os.path.join(directory, names[file_name])
+    return(profile_files)
+
+
+def profile_directory(profile):
+    ''' Return the Telemetry folder of a profile, given as a folder or as a dict of tbl type : path. '''
+
+    if isinstance(profile, dict):
+        return(os.path.dirname(profile['sln']))
+    return(profile)
+
+
+def parse_profile(profile, part_name, include_orphans=False, output_format='csv', cache_dir=None, cache_bytes=1 << 30,
+                  tbl_filter=None):
+    ''' Worker for run_batch. Parse the tables of one profile and write the joined rows, without a header, to the
+        csv file part_name, or with output_format='sqlite' load the tables into the SQLite database part_name.
+        profile is a Telemetry folder, or a dict of tbl type : path such as those returned by
+        tbl_discover.discover_profiles. If cache_dir is given, parsed tables are loaded from and saved to a
+        parseCache there. If tbl_filter (a tbl_filter.tblFilter) is given, only the evt entries it selects are
+        reported. Returns (directory, summary, error). Errors are returned rather than
+        raised so one bad profile does not stop the batch. '''
+
+    directory = profile_directory(profile)
+
+    try:
+        if isinstance(profile, dict):
+            profile_files = profile
+        else:
+            profile_files = find_profile_files(directory)
+        sln_table = open_tbl(profile_files['sln'], 'sln')
+        evt_table = open_tbl(profile_files['evt'], 'evt')
+        user_table = open_tbl(profile_files['user'], 'user')
+
+        if cache_dir is not None:
+            cache = parseCache(cache_dir, cache_bytes)
+            sln_table = cache.table('sln', profile_files['sln'], sln_table.columns)
+            evt_table = cache.table('evt', profile_files['evt'], evt_table.columns)
+
+        if tbl_filter is not None:
+            evt_table = tbl_filter.apply(sln_table, evt_table)
+
+        if output_format == 'sqlite':
+            sink = sqliteSink(part_name)
+            sink.write_profile(sln_table, evt_table, user_table)
+            sink.connection.close()
+            return(directory, sink.summary(), None)
+
+        join = docidIndex()
+        with open(part_name, 'w', newline='') as part:
+            writer = csv.writer(part, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            for row in iter_report_rows(sln_table, evt_table, user_table, include_orphans, join):
+                row.append(directory)
+                writer.writerow(row)
+
+        return(directory, join.summary(), None)
+
+    except Exception as error:
+        return(directory, None, '%s: %s' % (type(error).__name__, error))
+
+
+def run_batch(profiles, outfile_name, workers=None, include_orphans=False, output_format='csv', cache_dir=None,
+              cache_bytes=1 << 30, tbl_filter=None):
+    ''' Parse each profile (see parse_profile) across a pool of worker processes (one per core by default) and
+        merge the rows into one csv report, or with output_format='sqlite' into one SQLite database. Each worker
+        writes to a temporary part file; parts are appended to the output in the order of profiles as soon as
+        they are complete. cache_dir, cache_bytes and tbl_filter are passed on to parse_profile. Returns the
+        number of profiles that could not be parsed. '''
+
+    failed = 0
+    part_dir = tempfile.mkdtemp(prefix='msot-batch-')
+
+    if output_format == 'sqlite':
+        sink = sqliteSink(outfile_name)
+        csvfile = None
+    elif outfile_name == '-':
+        csvfile = sys.stdout
+    else:
+        csvfile = open(outfile_name, 'w', newline='')
+
+    try:
+        if csvfile is not None:
+            writer = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(batch_header)
+
+        part_names = [os.path.join(part_dir, 'part-%06d.%s' % (number, 'db' if output_format == 'sqlite' else 'csv'))
+                      for number in range(len(profiles))]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(parse_profile, profiles, part_names, [include_orphans] * len(profiles),
+                                   [output_format] * len(profiles), [cache_dir] * len(profiles),
+                                   [cache_bytes] * len(profiles), [tbl_filter] * len(profiles))
+
+            for part_name, (directory, summary, error) in zip(part_names, results):
+                if error is not None:
+                    failed += 1
+                    print('%s: %s' % (directory, error), file=sys.stderr)
+                    continue
+
+                print('%s: %s' % (directory, summary), file=sys.stderr)
+                if csvfile is None:
+                    sink.merge(part_name)
+                else:
+                    with open(part_name, 'r', newline='') as part:
+                        shutil.copyfileobj(part, csvfile)
+                os.remove(part_name)
+
+    finally:
+        if csvfile is None:
+            sink.close()
+        elif csvfile is not sys.stdout:
+            csvfile.close()
+        shutil.rmtree(part_dir, ignore_errors=True)
+
+    return(failed)
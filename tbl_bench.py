@@ -0,0 +1,199 @@
+###############################################################################
+#
+# Benchmark runner for libmsot. Times each parser stage over a Telemetry
+# folder (a synthetic one from tbl_generate.py by default) and reports
+# records/s, MB/s and peak RSS. Results can be saved as JSON and compared
+# with an earlier run.
+#
+# Usage: python tbl_bench.py [--documents N] [--events N] [--corpus DIR]
+#                            [--repeat N] [--output results.json]
+#                            [--compare baseline.json]
+#
+###############################################################################
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from sln_tbl_parse import *
+from evt_tbl_parse import *
+from user_tbl_parse import *
+from tbl_join import docidIndex
+from tbl_report import iter_report_rows, write_csv_report
+from tbl_batch import find_profile_files
+from tbl_generate import generate_profile
+from tbl_stats import peak_rss
+
+
+# Each stage takes the dict of tbl type : path of a Telemetry folder and returns the number of records it
+# processed. Stages parse from scratch, so each one includes the work of the stages it depends on.
+
+def stage_sln_scan(profile_files):
+    ''' Find the sln.tbl blocks without decoding them. '''
+    return(len(list(slnTable(open_tbl_buffer(profile_files['sln'])).locate_blocks())))
+
+
+def stage_sln_parse(profile_files):
+    ''' Parse sln.tbl, decoding every string field. '''
+    return(sum(1 for entry in slnTable(open_tbl_buffer(profile_files['sln'])).iter_entries()))
+
+
+def stage_sln_parse_lazy(profile_files):
+    ''' Parse sln.tbl into lazy records, as the report does for its docid index. '''
+    return(sum(1 for entry in slnTable(open_tbl_buffer(profile_files['sln'])).iter_entries(lazy=True)))
+
+
+def stage_evt_map(profile_files):
+    ''' Map the evt.tbl blocks onto the structured block array. '''
+    evt_table = evtTable(open_tbl_buffer(profile_files['evt']))
+    evt_table.parse_entries()
+    return(len(evt_table.records))
+
+
+def stage_evt_timestamps(profile_files):
+    ''' Convert both evt.tbl timestamp columns to datetimes. '''
+    evt_table = evtTable(open_tbl_buffer(profile_files['evt']))
+    evt_table.parse_entries()
+    evt_table.datetimes_1()
+    evt_table.datetimes_2()
+    return(len(evt_table.records))
+
+
+def stage_evt_parse(profile_files):
+    ''' Parse evt.tbl into evtRecords. '''
+    return(sum(1 for entry in evtTable(open_tbl_buffer(profile_files['evt'])).iter_entries()))
+
+
+def stage_user_parse(profile_files):
+    ''' Parse user.tbl. '''
+    return(sum(1 for entry in userTable(open_tbl_buffer(profile_files['user'])).iter_entries()))
+
+
+def stage_report(profile_files):
+    ''' Join all three tables and write the csv report to the null device. '''
+    join = docidIndex()
+    write_csv_report(iter_report_rows(slnTable(open_tbl_buffer(profile_files['sln'])),
+                                      evtTable(open_tbl_buffer(profile_files['evt'])),
+                                      userTable(open_tbl_buffer(profile_files['user'])), True, join), os.devnull)
+    return(join.matched + sum(join.orphans.values()))
+
+
+# Stage name : (function, tbl types whose bytes the stage reads)
+bench_stages = {
+    'sln.scan':       (stage_sln_scan, ('sln',)),
+    'sln.parse':      (stage_sln_parse, ('sln',)),
+    'sln.parse_lazy': (stage_sln_parse_lazy, ('sln',)),
+    'evt.map':        (stage_evt_map, ('evt',)),
+    'evt.timestamps': (stage_evt_timestamps, ('evt',)),
+    'evt.parse':      (stage_evt_parse, ('evt',)),
+    'user.parse':     (stage_user_parse, ('user',)),
+    'report':         (stage_report, ('sln', 'evt', 'user')),
+}
+
+
+def run_stage(stage_name, profile_files, repeat):
+    ''' Run one stage repeat times and return its result dict. Called in a fresh worker process, so peak RSS
+        covers only this stage (plus the interpreter and imports). The fastest run is reported. '''
+
+    stage, tbl_types = bench_stages[stage_name]
+    size = sum(os.path.getsize(profile_files[tbl_type]) for tbl_type in tbl_types)
+
+    timings = []
+    for run in range(repeat):
+        start = time.perf_counter()
+        records = stage(profile_files)
+        timings.append(time.perf_counter() - start)
+
+    seconds = min(timings)
+    return({'records': records,
+            'bytes': size,
+            'seconds': seconds,
+            'all_seconds': timings,
+            'records_per_sec': records / seconds if seconds else None,
+            'mb_per_sec': size / 1e6 / seconds if seconds else None,
+            'peak_rss': peak_rss()})
+
+
+def run_benchmark(profile_files, stage_names=None, repeat=3):
+    ''' Run each stage in stage_names (all stages by default) over the tables in profile_files, each in its own
+        process. Returns the results as a dict suitable for JSON. '''
+
+    results = {'created': datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(),
+               'numpy': np.__version__,
+               'platform': platform.platform(),
+               'repeat': repeat,
+               'corpus': {tbl_type: {'path': path, 'bytes': os.path.getsize(path)}
+                          for tbl_type, path in profile_files.items()},
+               'stages': {}}
+
+    for stage_name in stage_names or bench_stages:
+        # A new single-worker pool per stage, so each stage starts from a fresh process
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            results['stages'][stage_name] = executor.submit(run_stage, stage_name, profile_files, repeat).result()
+    return(results)
+
+
+def format_results(results, baseline=None):
+    ''' Format benchmark results as a text table. If baseline results are given, add the speedup of each stage
+        relative to them, as a ratio of records/s so runs over corpora of different sizes can be compared. '''
+
+    lines = ['%-16s %10s %10s %12s %10s %10s%s' % ('stage', 'records', 'seconds', 'records/s', 'MB/s', 'peak MB',
+                                                   ' %10s' % 'speedup' if baseline else '')]
+    for stage_name, stage in results['stages'].items():
+        line = '%-16s %10d %10.4f %12.0f %10.1f %10s' % (
+            stage_name, stage['records'], stage['seconds'], stage['records_per_sec'] or 0, stage['mb_per_sec'] or 0,
+            '%.1f' % (stage['peak_rss'] / 1e6) if stage['peak_rss'] is not None else '-')
+        if baseline:
+            previous = baseline['stages'].get(stage_name)
+            speedup = previous and previous['records_per_sec'] and stage['records_per_sec']
+            line += ' %10s' % ('%.2fx' % (stage['records_per_sec'] / previous['records_per_sec']) if speedup else '-')
+        lines.append(line)
+    return('\n'.join(lines))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(prog='tbl_bench.py', description='Benchmark the libmsot parser stages.')
+    parser.add_argument('--corpus', metavar='DIR',
+                        help='Telemetry folder to benchmark (default: generate a synthetic one in a temporary folder)')
+    parser.add_argument('--documents', type=int, default=10000, metavar='N',
+                        help='sln.tbl entries to generate (default: 10000)')
+    parser.add_argument('--events', type=int, default=1000000, metavar='N',
+                        help='evt.tbl entries to generate (default: 1000000)')
+    parser.add_argument('--stage', action='append', choices=list(bench_stages), dest='stages',
+                        help='only run this stage (may be repeated)')
+    parser.add_argument('--repeat', type=int, default=3, metavar='N', help='runs per stage; the fastest is reported')
+    parser.add_argument('--output', metavar='FILE', help='save the results as JSON')
+    parser.add_argument('--compare', metavar='FILE', help='JSON results of an earlier run to compare against')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='msot-bench-') as corpus_dir:
+        if args.corpus:
+            profile_files = find_profile_files(args.corpus)
+        else:
+            print('Generating %d documents and %d events...' % (args.documents, args.events), file=sys.stderr)
+            profile_files = generate_profile(corpus_dir, args.documents, args.events)
+
+        results = run_benchmark(profile_files, args.stages, args.repeat)
+        if not args.corpus:
+            results['generated'] = {'documents': args.documents, 'events': args.events}
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+
+    print(format_results(results, baseline))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
@@ -0,0 +1,206 @@
+###############################################################################
+#
+# On-disk cache of parsed sln.tbl and evt.tbl tables, so repeat runs over
+# the same evidence skip parsing.
+#
+###############################################################################
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from misc_functions import open_tbl_buffer
+from evt_tbl_parse import evt_event_codes
+from tbl_records import evtColumns, slnColumns, slnRecord
+from tbl_index import evtIndex
+
+
+# Version of the layout of the cached files. It is part of content_key, so files cached by another version are
+# not read; raise it whenever the stored arrays change.
+cache_format_version = 1
+
+# Number and size of the samples hashed by content_key
+cache_sample_count = 16
+cache_sample_size = 65536
+
+# Columns stored for each table type
+evt_cache_columns = ('offsets', 'entry_nums', 'timestamps_1', 'event_ids', 'docids', 'timestamps_2')
+
+
+def content_key(path):
+    ''' Return a cache key for a file, from the cache format version, the file's size, its modification time and
+        a fast hash of its content. Only the header, the end and evenly spaced samples of the content are hashed, so
+        the cost does not depend on the file size; the size and modification time catch changes outside the
+        samples. '''
+
+    stat = os.stat(path)
+    key = hashlib.blake2b(digest_size=20)
+    key.update(b'v%d:%d:%d:' % (cache_format_version, stat.st_size, stat.st_mtime_ns))
+
+    content = open_tbl_buffer(path)
+    size = len(content)
+    if size <= cache_sample_count * cache_sample_size:
+        key.update(content[:])
+    else:
+        step = (size - cache_sample_size) // (cache_sample_count - 1)
+        for sample in range(cache_sample_count):
+            key.update(content[sample * step:sample * step + cache_sample_size])
+
+    return(key.hexdigest())
+
+
+def encode_strings(strings):
+    ''' Store a column of strings as one UTF-8 byte array. Decoded .tbl strings never contain NUL, which is
+        used as the separator. '''
+
+    return(np.frombuffer('\x00'.join(strings).encode('utf-8'), dtype=np.uint8))
+
+
+def decode_strings(encoded, count):
+    ''' Inverse of encode_strings. '''
+
+    if count == 0:
+        return([])
+    return(encoded.tobytes().decode('utf-8').split('\x00'))
+
+
+class parseCache:
+
+    ''' Directory of parsed tables, one .npz file per table, named by tbl type and content_key. The evtIndex of
+        an evt table is kept in a separate .npz file, named the same way with the type 'evtindex'. Loading a
+        table marks it as recently used; when the total size goes over max_bytes the least recently used
+        tables are evicted. Files are written atomically, so several processes can share a cache. '''
+
+    def __init__(self, cache_dir, max_bytes=1 << 30):
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def cache_name(self, tbl_type, path):
+        ''' Return the name of the cache file of the file at path. This hashes the file (see content_key), so
+            callers that both load and store compute it once and pass it to both. '''
+        return(os.path.join(self.cache_dir, '%s-%s.npz' % (tbl_type, content_key(path))))
+
+    def load(self, tbl_type, path, cache_name=None):
+
+        ''' Return the cached evtColumns or slnColumns for the file at path, or None if it is not cached. '''
+
+        if cache_name is None:
+            cache_name = self.cache_name(tbl_type, path)
+        try:
+            with np.load(cache_name) as cached:
+                if tbl_type == 'evt':
+                    columns = evtColumns(*[cached[name] for name in evt_cache_columns], event_codes=evt_event_codes)
+                else:
+                    count = len(cached['offsets'])
+                    columns = slnColumns(cached['offsets'], *[decode_strings(cached[name], count) for name in slnRecord._fields])
+        except (OSError, KeyError, ValueError):
+            # Not cached, or evicted or damaged in the meantime
+            return(None)
+
+        # Mark as recently used
+        os.utime(cache_name)
+        return(columns)
+
+    def store(self, tbl_type, path, columns, cache_name=None):
+
+        ''' Cache the evtColumns or slnColumns parsed from the file at path, then evict old entries if needed. '''
+
+        if tbl_type == 'evt':
+            arrays = {name: getattr(columns, name) for name in evt_cache_columns}
+        else:
+            arrays = {name: encode_strings(getattr(columns, name)) for name in slnRecord._fields}
+            arrays['offsets'] = columns.offsets
+
+        if cache_name is None:
+            cache_name = self.cache_name(tbl_type, path)
+        self.write(cache_name, arrays)
+
+    def write(self, cache_name, arrays):
+
+        ''' Save arrays to cache_name atomically, then evict old entries if needed. '''
+
+        temp_file, temp_name = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(temp_file, 'wb') as cache_file:
+                np.savez(cache_file, **arrays)
+            os.replace(temp_name, cache_name)
+        except BaseException:
+            os.remove(temp_name)
+            raise
+
+        self.evict()
+
+    def load_index(self, path, cache_name=None):
+
+        ''' Return the cached evtIndex for the evt.tbl at path, or None if it is not cached. '''
+
+        if cache_name is None:
+            cache_name = self.cache_name('evtindex', path)
+        try:
+            with np.load(cache_name) as cached:
+                index = evtIndex.from_arrays(cached)
+        except (OSError, KeyError, ValueError):
+            return(None)
+
+        os.utime(cache_name)
+        return(index)
+
+    def store_index(self, path, index, cache_name=None):
+
+        ''' Cache the evtIndex built over the whole evt.tbl at path. '''
+
+        if cache_name is None:
+            cache_name = self.cache_name('evtindex', path)
+        self.write(cache_name, index.as_arrays())
+
+    def index(self, path, evt_table):
+
+        ''' Give evt_table (the evtTable or evtColumns of the whole evt.tbl at path) its evtIndex from the cache,
+            or build and cache it if it is not cached. Returns the index. '''
+
+        cache_name = self.cache_name('evtindex', path)
+        index = self.load_index(path, cache_name)
+        if index is None or index.record_count != len(evt_table.event_ids):
+            index = evtIndex.build(evt_table)
+            self.store_index(path, index, cache_name)
+        evt_table.index = index
+        return(index)
+
+    def evict(self):
+
+        ''' Remove the least recently used tables until the cache fits in max_bytes. '''
+
+        cached = []
+        for dir_entry in os.scandir(self.cache_dir):
+            if dir_entry.name.endswith('.npz'):
+                try:
+                    stat = dir_entry.stat()
+                except FileNotFoundError:
+                    continue
+                cached.append((stat.st_mtime, stat.st_size, dir_entry.path))
+
+        total = sum(size for mtime, size, cache_name in cached)
+        for mtime, size, cache_name in sorted(cached):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(cache_name)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def table(self, tbl_type, path, parse):
+
+        ''' Return the columns for the file at path from the cache. If they are not cached, call parse() to get
+            them and cache the result. '''
+
+        cache_name = self.cache_name(tbl_type, path)
+        columns = self.load(tbl_type, path, cache_name)
+        if columns is None:
+            columns = parse()
+            self.store(tbl_type, path, columns, cache_name)
+        return(columns)
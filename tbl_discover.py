@@ -0,0 +1,94 @@
+###############################################################################
+#
+# Discovery of Office Telemetry folders on mounted images and directory trees
+#
+###############################################################################
+
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from misc_functions import sniff_tbl_type, tblFormatError
+
+
+def sniff_file(path):
+    ''' Read the 16-byte header of a file and return its tbl type ('sln', 'evt' or 'user'), or None if it is not
+        one of the three. Files that cannot be read are treated as not being .tbl files. '''
+
+    try:
+        return(sniff_tbl_type(path))
+    except (OSError, tblFormatError):
+        return(None)
+
+
+def scan_directory(directory, sniff_all=False):
+    ''' Scan one directory. Returns (subdirectories, {tbl type: [paths]}, error). Only files with a .tbl extension
+        are sniffed unless sniff_all is set. Symbolic links are not followed. '''
+
+    subdirectories = []
+    found = {}
+
+    try:
+        with os.scandir(directory) as scan:
+            for dir_entry in scan:
+                try:
+                    if dir_entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(dir_entry.path)
+                    elif dir_entry.is_file(follow_symlinks=False):
+                        if sniff_all or dir_entry.name.lower().endswith('.tbl'):
+                            tbl_type = sniff_file(dir_entry.path)
+                            if tbl_type is not None:
+                                found.setdefault(tbl_type, []).append(dir_entry.path)
+                except OSError:
+                    continue
+    except OSError as error:
+        return(subdirectories, found, error)
+
+    return(subdirectories, found, None)
+
+
+def pick_profile_file(tbl_type, paths):
+    ''' Choose between several files of the same tbl type in one folder, preferring the one with the standard name. '''
+
+    for path in sorted(paths):
+        if os.path.basename(path).lower() == tbl_type + '.tbl':
+            return(path)
+    return(sorted(paths)[0])
+
+
+def discover_profiles(root, workers=None, sniff_all=False):
+    ''' Walk the directory tree under root and return a list of Telemetry folders, each as a dict of
+        tbl type : path with one sln, evt and user table. Files are identified by their header rather than
+        their name. Directories are scanned (and their files sniffed) in parallel by a pool of threads, since
+        the work is dominated by I/O latency on evidence mounts. Folders holding only some of the three
+        tables are reported on stderr and skipped. '''
+
+    profiles = []
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(scan_directory, root, sniff_all)}
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                subdirectories, found, error = future.result()
+
+                if error is not None:
+                    print('Unable to scan %s: %s' % (error.filename, error.strerror), file=sys.stderr)
+
+                for subdirectory in subdirectories:
+                    pending.add(executor.submit(scan_directory, subdirectory, sniff_all))
+
+                if not found:
+                    continue
+
+                directory = os.path.dirname(next(iter(found.values()))[0])
+                if len(found) == 3:
+                    profiles.append({tbl_type: pick_profile_file(tbl_type, paths) for tbl_type, paths in found.items()})
+                else:
+                    print('Incomplete Telemetry folder %s: only %s found' % (directory, ', '.join(sorted(found))), file=sys.stderr)
+
+    # The walk completes in no particular order. Sort so the report order is repeatable.
+    profiles.sort(key=lambda profile: profile['sln'])
+    return(profiles)
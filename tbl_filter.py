@@ -0,0 +1,112 @@
+###############################################################################
+#
+# Filters for libmsot reports. Conditions on evt entries are checked
+# against the raw FILETIME, event ID and docid columns, before any string
+# is decoded or datetime built; conditions on sln entries are only checked
+# for documents that a selected evt entry refers to.
+#
+###############################################################################
+
+import numpy as np
+
+from misc_functions import datetime_to_filetime
+from tbl_records import docids_to_hex
+
+
+class tblFilter:
+
+    ''' Selection of report rows.
+            since, until   datetimes; keep events whose timestamp (timestamp 2, the report timestamp) is within
+                           [since, until]. Events with an unset timestamp are dropped when either is given.
+            event_ids      keep events with one of these event IDs
+            item_types     keep events about sln entries of one of these item types
+            path_prefix    keep events about sln entries whose full path (path\\name) starts with this,
+                           ignoring case
+        Conditions left as None are not checked. Events whose docid is not in sln.tbl (orphans) never match the
+        sln conditions. '''
+
+    def __init__(self, since=None, until=None, event_ids=None, item_types=None, path_prefix=None):
+
+        self.since = since
+        self.until = until
+        self.event_ids = sorted(set(event_ids)) if event_ids else None
+        self.item_types = set(item_types) if item_types else None
+        self.path_prefix = path_prefix.casefold() if path_prefix else None
+
+        # Number of evt entries before and after filtering, by the last apply
+        self.total = 0
+        self.selected = 0
+
+    @property
+    def active(self):
+        return(self.evt_active or self.sln_active)
+
+    @property
+    def evt_active(self):
+        return(self.since is not None or self.until is not None or self.event_ids is not None)
+
+    @property
+    def sln_active(self):
+        return(self.item_types is not None or self.path_prefix is not None)
+
+    def evt_mask(self, evt_table):
+
+        ''' Return a boolean mask of the entries of a parsed evtTable (or evtColumns) that meet the evt conditions.
+            Only the raw integer columns are read. '''
+
+        mask = np.ones(len(evt_table.event_ids), dtype=bool)
+
+        if self.since is not None or self.until is not None:
+            timestamps = evt_table.timestamps_2
+            mask &= timestamps != 0
+            if self.since is not None:
+                mask &= timestamps >= datetime_to_filetime(self.since)
+            if self.until is not None:
+                mask &= timestamps <= datetime_to_filetime(self.until)
+
+        if self.event_ids is not None:
+            mask &= np.isin(evt_table.event_ids, self.event_ids)
+
+        return(mask)
+
+    def sln_matches(self, sln_entry):
+
+        ''' Return whether an sln entry meets the sln conditions. The item type is checked first; for slnLazyRecords,
+            the name and path are only decoded if a path prefix is given and the item type matched. '''
+
+        if self.item_types is not None and sln_entry.item_type not in self.item_types:
+            return(False)
+        if self.path_prefix is not None:
+            return((sln_entry.doc_path + '\\' + sln_entry.doc_name).casefold().startswith(self.path_prefix))
+        return(True)
+
+    def apply(self, sln_table, evt_table):
+
+        ''' Return an evtColumns holding only the entries of evt_table (an evtTable or evtColumns) that meet every
+            condition. For the sln conditions, only the sln entries referenced by an evt entry that met the evt
+            conditions are checked. '''
+
+        if not getattr(evt_table, 'parsed', True):
+            evt_table.parse_entries()
+
+        mask = self.evt_mask(evt_table)
+
+        if self.sln_active:
+            docids = np.ascontiguousarray(evt_table.docids).view('S16')
+            referenced = set(docids_to_hex(np.unique(docids[mask])))
+
+            allowed = []
+            for offset, sln_entry in sln_table.iter_entries(lazy=True):
+                if sln_entry.docid in referenced and self.sln_matches(sln_entry):
+                    allowed.append(bytes.fromhex(sln_entry.docid))
+            mask &= np.isin(docids, np.array(allowed, dtype='S16'))
+
+        self.total = len(mask)
+        self.selected = int(mask.sum())
+        return(evt_table.take(mask))
+
+    def summary(self):
+
+        ''' Return a short, human readable summary of the last apply. '''
+
+        return('%d of %d evt entries selected by the filter' % (self.selected, self.total))
@@ -0,0 +1,177 @@
+###############################################################################
+#
+# Synthetic .tbl corpus generator for libmsot. Writes a Telemetry folder
+# (sln.tbl, evt.tbl and user.tbl) following the layouts in
+# Documentation/Microsoft Office Telemetry Log (TBL) Format.md, with any
+# number of documents and events. Used by tbl_bench.py; also useful as test
+# data, since real telemetry logs are not distributed with the parser.
+#
+# Usage: python tbl_generate.py output_dir [--documents N] [--events N]
+#
+###############################################################################
+
+import argparse
+import os
+import struct
+
+import numpy as np
+
+from misc_functions import tbl_signature, epoch_as_filetime_us
+from sln_tbl_parse import sln_header_size, sln_block_size, sln_block_signature, sln_string_fields, sln_item_types
+from evt_tbl_parse import evt_header_size, evt_block_dtype
+
+
+# Second half of the header of each table type
+sln_type_signature = bytes.fromhex('01000000564e4953')
+evt_type_signature = bytes.fromhex('01000000544e5645')
+user_type_signature = bytes.fromhex('0100000052455355')
+
+# Item type values at bytes 1116 - 1119 of an sln block
+generator_item_types = {name: struct.pack('<I', value) for value, name in sln_item_types.items()}
+
+# Event IDs, weighted roughly as seen in real logs: mostly document loads, closes and session extensions
+generator_event_ids = np.array([1, 13, 14, 5, 17, 18, 2, 6, 11, 12, 16], dtype=np.uint32)
+generator_event_weights = np.array([30, 28, 12, 10, 8, 6, 2, 1, 1, 1, 1], dtype=np.float64)
+
+# First timestamp of the generated events: 2017-01-01 00:00:00 UTC, as a FILETIME
+generator_start_time = (1483228800000000 + epoch_as_filetime_us) * 10
+
+# evt blocks are generated and written this many at a time, so memory use does not grow with the table size
+generator_chunk_size = 65536
+
+
+def utf16_field(text, size):
+    ''' Encode text as a NUL padded UTF-16LE field of size bytes. '''
+
+    return(text.encode('utf-16-le')[:size - 2].ljust(size, b'\x00'))
+
+
+def document_strings(number, item_type):
+    ''' Return a dict of string field : value for generated document number. doc_path is the folder holding
+        the document, as in real logs. '''
+
+    if item_type == 'application_dll':
+        name = 'addin%d.dll' % number
+        return({'doc_name': name,
+                'doc_path': 'C:\\Program Files\\Vendor %d' % (number % 97),
+                'doc_title': 'Add-in %d' % number,
+                'doc_author': 'Vendor %d' % (number % 97),
+                'addin_name': 'Add-in %d' % number,
+                'description': 'Generated add-in n\u00b0%d' % number})
+
+    name = 'document %d.%s' % (number, ('docx', 'xlsx', 'pptx')[number % 3])
+    return({'doc_name': name,
+            'doc_path': 'C:\\Users\\user%d\\Documents' % (number % 13),
+            'doc_title': 'Document %d' % number,
+            'doc_author': 'Author %d' % (number % 251)})
+
+
+def write_sln(path, docids, item_types):
+    ''' Write an sln.tbl holding one block per docid. item_types holds the item type of each block. '''
+
+    with open(path, 'wb') as sln_file:
+        sln_file.write((tbl_signature + sln_type_signature).ljust(sln_header_size, b'\x00'))
+
+        # Blocks are written one at a time; the file object buffers them
+        for number, docid in enumerate(docids):
+            item_type = item_types[number]
+            block = bytearray(sln_block_size)
+            block[0:4] = sln_block_signature
+            block[4:20] = docid
+            block[1116:1120] = generator_item_types[item_type]
+            for name, text in document_strings(number, item_type).items():
+                field_start, field_stop = sln_string_fields[item_type][name]
+                block[field_start:field_stop] = utf16_field(text, field_stop - field_start)
+            sln_file.write(block)
+
+
+def write_evt(path, docids, count, random_state, orphan_fraction=0.02, unset_fraction=0.01):
+    ''' Write an evt.tbl holding count events about randomly chosen docids. orphan_fraction of the events refer to
+        docids that are not in docids, and unset_fraction have a zero second timestamp. '''
+
+    docid_column = np.frombuffer(b''.join(docids), dtype='V16') if docids else np.zeros(0, dtype='V16')
+    probabilities = generator_event_weights / generator_event_weights.sum()
+    timestamp = generator_start_time
+
+    with open(path, 'wb') as evt_file:
+        evt_file.write((tbl_signature + evt_type_signature).ljust(evt_header_size, b'\x00'))
+
+        for start in range(0, count, generator_chunk_size):
+            size = min(generator_chunk_size, count - start)
+            blocks = np.zeros(size, dtype=evt_block_dtype)
+            blocks['block_size'] = evt_block_dtype.itemsize
+            blocks['entry_num'] = np.arange(start, start + size, dtype=np.uint32)
+
+            # Events between 1 and 600 seconds apart
+            timestamps = timestamp + np.cumsum(random_state.integers(1, 600, size, dtype=np.uint64) * 10000000)
+            timestamp = int(timestamps[-1])
+            blocks['timestamp_1'] = timestamps
+            blocks['timestamp_2'] = timestamps + random_state.integers(0, 10000, size, dtype=np.uint64)
+            blocks['timestamp_2'][random_state.random(size) < unset_fraction] = 0
+
+            blocks['event_id'] = random_state.choice(generator_event_ids, size, p=probabilities)
+            if len(docid_column):
+                blocks['guid'] = docid_column[random_state.integers(0, len(docid_column), size)]
+            orphans = random_state.random(size) < orphan_fraction if len(docid_column) else np.ones(size, dtype=bool)
+            blocks['guid'][orphans] = np.frombuffer(random_state.bytes(16 * int(orphans.sum())), dtype='V16')
+            blocks['footer'] = 0xffffffff
+
+            evt_file.write(blocks.tobytes())
+
+
+def write_user(path):
+    ''' Write a user.tbl for a generated user and machine. '''
+
+    record = bytearray(2406)
+    record[0:16] = tbl_signature + user_type_signature
+    record[36:44] = struct.pack('<Q', generator_start_time)
+    record[44:558] = utf16_field('generated.user', 514)
+    record[558:1110] = utf16_field('CORP', 552)
+    record[1124:1156] = utf16_field('BENCH-PC', 32)
+    record[1156:1668] = utf16_field('corp.example.com', 512)
+    # Agent version 16.0.4266.1001
+    record[1668:1676] = struct.pack('<HHHH', 0, 16, 4266, 1001)
+    record[1676:2196] = utf16_field('\\\\fileserver\\telemetry', 520)
+    record[2196:2356] = utf16_field('Generated hardware', 160)
+    record[2356:2380] = struct.pack('<IIIIII', 8, 4, 9, 16384, 1080, 1920)
+    # Windows 10.0, workstation, build 19045; language en-US
+    record[2380:2388] = struct.pack('<HHHH', 0, 10, 1, 19045)
+    record[2388:2394] = struct.pack('<HHH', 1033, 0, 1033)
+    record[2396:2404] = struct.pack('<HHHH', 0, 11, 19041, 0)
+
+    with open(path, 'wb') as user_file:
+        user_file.write(record)
+
+
+def generate_profile(directory, documents=1000, events=10000, dll_fraction=0.2, seed=0):
+    ''' Write sln.tbl, evt.tbl and user.tbl into directory, with documents sln entries (dll_fraction of them
+        application_dll entries, the rest user_document entries) and events evt entries. The same seed always
+        gives the same files. Returns a dict of tbl type : path. '''
+
+    os.makedirs(directory, exist_ok=True)
+    random_state = np.random.default_rng(seed)
+
+    docids = [random_state.bytes(16) for number in range(documents)]
+    item_types = np.where(random_state.random(documents) < dll_fraction, 'application_dll', 'user_document').tolist()
+
+    profile_files = {tbl_type: os.path.join(directory, '%s.tbl' % tbl_type) for tbl_type in ('sln', 'evt', 'user')}
+    write_sln(profile_files['sln'], docids, item_types)
+    write_evt(profile_files['evt'], docids, events, random_state)
+    write_user(profile_files['user'])
+    return(profile_files)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(prog='tbl_generate.py',
+                                     description='Write a synthetic Telemetry folder (sln.tbl, evt.tbl, user.tbl).')
+    parser.add_argument('output_dir')
+    parser.add_argument('--documents', type=int, default=1000, metavar='N', help='number of sln.tbl entries')
+    parser.add_argument('--events', type=int, default=10000, metavar='N', help='number of evt.tbl entries')
+    parser.add_argument('--dll-fraction', type=float, default=0.2,
+                        help='fraction of sln.tbl entries that are add-ins rather than documents (default: 0.2)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for tbl_type, path in generate_profile(args.output_dir, args.documents, args.events, args.dll_fraction, args.seed).items():
+        print('%s: %d bytes' % (path, os.path.getsize(path)))
@@ -0,0 +1,157 @@
+###############################################################################
+#
+# Secondary indexes over parsed evt.tbl columns, for repeated lookups of
+# "all events with this event ID" or "all events for this document"
+# without scanning the table each time.
+#
+# Each index is stored in compressed sparse row form: the distinct keys in
+# sorted order, and for each key a run of record positions (in file order)
+# in one shared positions array. An index over n events takes 4 bytes per
+# event plus a few bytes per distinct key.
+#
+###############################################################################
+
+import numpy as np
+
+
+class postingIndex:
+
+    ''' Index from the values of one column to the positions of the records holding them.
+            keys       distinct values, sorted
+            bounds     positions[bounds[i]:bounds[i + 1]] are the records holding keys[i]
+            positions  record positions, grouped by key and in ascending order within each key '''
+
+    def __init__(self, keys, bounds, positions):
+        self.keys = keys
+        self.bounds = bounds
+        self.positions = positions
+
+    @classmethod
+    def build(cls, column):
+
+        ''' Build the index of a column (any sortable NumPy array). '''
+
+        # A stable sort keeps the positions of each key in file order
+        positions = np.argsort(column, kind='stable').astype(np.uint32)
+        keys, starts = np.unique(column[positions], return_index=True)
+        bounds = np.append(starts, len(column)).astype(np.uint32)
+        return(cls(keys, bounds, positions))
+
+    def __len__(self):
+        return(len(self.keys))
+
+    def lookup(self, key):
+
+        ''' Return the positions of the records holding key (an empty array if there are none, including when key
+            does not fit the type of the keys, e.g. a negative event ID). '''
+
+        try:
+            key = np.asarray(key, dtype=self.keys.dtype)
+        except (OverflowError, ValueError):
+            return(self.positions[:0])
+        found = int(np.searchsorted(self.keys, key))
+        if found == len(self.keys) or self.keys[found] != key:
+            return(self.positions[:0])
+        return(self.positions[self.bounds[found]:self.bounds[found + 1]])
+
+    def counts(self):
+
+        ''' Return a dict of key : number of records. '''
+
+        return(dict(zip(self.keys.tolist(), np.diff(self.bounds).tolist())))
+
+
+def docid_keys(docids):
+    ''' View a column of 16-byte docids as sortable byte strings. '''
+
+    return(np.ascontiguousarray(docids).view('S16'))
+
+
+def docid_key(docid):
+    ''' Convert a docid given as a hex string (as in evtRecord.docid) or 16 raw bytes to an index key. '''
+
+    if isinstance(docid, str):
+        docid = bytes.fromhex(docid)
+    return(np.bytes_(docid))
+
+
+class evtIndex:
+
+    ''' Per-event-ID and per-docid indexes over the records of an evtTable or evtColumns. Positions are
+        indices into that table's columns, so they can be passed to its take method. '''
+
+    # Prefixes of the arrays of each postingIndex in as_arrays
+    index_names = ('event_id', 'docid')
+
+    def __init__(self, record_count, event_id, docid):
+        self.record_count = record_count
+        self.event_id = event_id
+        self.docid = docid
+
+    @classmethod
+    def build(cls, evt_table):
+        return(cls(len(evt_table.event_ids),
+                   postingIndex.build(np.asarray(evt_table.event_ids)),
+                   postingIndex.build(docid_keys(evt_table.docids))))
+
+    def by_event_id(self, event_id):
+        ''' Positions of the records with event ID event_id. '''
+        return(self.event_id.lookup(event_id))
+
+    def by_docid(self, docid):
+        ''' Positions of the records for document docid (a hex string or 16 bytes). '''
+        return(self.docid.lookup(docid_key(docid)))
+
+    @property
+    def nbytes(self):
+        return(sum(array.nbytes for array in self.as_arrays().values()))
+
+    def as_arrays(self):
+
+        ''' Return the index as a dict of name : array, e.g. for np.savez. '''
+
+        arrays = {'record_count': np.array(self.record_count, dtype=np.int64)}
+        for name in self.index_names:
+            index = getattr(self, name)
+            arrays.update({name + '_keys': index.keys, name + '_bounds': index.bounds,
+                           name + '_positions': index.positions})
+        return(arrays)
+
+    @classmethod
+    def from_arrays(cls, arrays):
+
+        ''' Inverse of as_arrays. '''
+
+        return(cls(int(arrays['record_count']),
+                   *[postingIndex(arrays[name + '_keys'], arrays[name + '_bounds'], arrays[name + '_positions'])
+                     for name in cls.index_names]))
+
+
+class evtQueries:
+
+    ''' Query methods shared by evtTable and evtColumns. The index is built on the first query, or can be set
+        beforehand (e.g. from parseCache.index). '''
+
+    __slots__ = ()
+
+    def get_index(self):
+
+        ''' Return the evtIndex of the table, building it if needed. '''
+
+        if not getattr(self, 'parsed', True):
+            self.parse_entries()
+        if self.index is None or self.index.record_count != len(self.event_ids):
+            self.index = evtIndex.build(self)
+        return(self.index)
+
+    def events_by_event_id(self, event_id):
+        ''' Return an evtColumns of the entries with event ID event_id, in file order. '''
+        return(self.take(self.get_index().by_event_id(event_id)))
+
+    def events_by_docid(self, docid):
+        ''' Return an evtColumns of the entries for document docid (a hex string or 16 bytes), in file order. '''
+        return(self.take(self.get_index().by_docid(docid)))
+
+    def event_id_counts(self):
+        ''' Return a dict of event ID : number of entries. '''
+        return(self.get_index().event_id.counts())
@@ -0,0 +1,70 @@
+###############################################################################
+#
+# Join of sln.tbl and evt.tbl entries on their docid (document GUID)
+#
+###############################################################################
+
+from collections import Counter
+
+
+class docidIndex:
+
+    ''' Hash index of sln entries keyed by docid. The index is built in one pass over the sln entries and
+        probed in one pass over the evt entries. evt entries whose docid has no sln entry (orphans) are
+        counted rather than reported one by one. '''
+
+    def __init__(self):
+
+        # docid : (sln offset, sln entry)
+        self.index = {}
+
+        # Number of sln entries whose docid was already in the index. The first entry is kept.
+        # TODO: It doesn't appear the SLN table will contain duplicate DOCID entries.
+        self.duplicates = 0
+
+        # Number of evt entries that matched an sln entry
+        self.matched = 0
+        # docid : number of evt entries with that docid and no sln entry
+        self.orphans = Counter()
+
+    def build(self, sln_entries):
+
+        ''' Index an iterable of (offset, sln entry) pairs, such as slnTable.iter_entries(). '''
+
+        for offset, sln_entry in sln_entries:
+            # sln entry[1] is the docid
+            if sln_entry[1] in self.index:
+                self.duplicates += 1
+            else:
+                self.index[sln_entry[1]] = (offset, sln_entry)
+
+        return(self)
+
+    def probe(self, evt_entries, outer=False):
+
+        ''' Generator joining an iterable of (offset, evt entry) pairs, such as evtTable.iter_entries(), to the
+            index. Yields (sln entry, evt offset, evt entry) in evt order. Orphaned evt entries are skipped, or with
+            outer=True are yielded with an sln entry of None. '''
+
+        index = self.index
+        for evt_offset, evt_entry in evt_entries:
+            # evt entry[4] is the docid
+            found = index.get(evt_entry[4])
+            if found is not None:
+                self.matched += 1
+                yield (found[1], evt_offset, evt_entry)
+            else:
+                self.orphans[evt_entry[4]] += 1
+                if outer:
+                    yield (None, evt_offset, evt_entry)
+
+    def summary(self):
+
+        ''' Return a short, human readable summary of the join. '''
+
+        summary = '%d sln entries indexed, %d evt entries matched' % (len(self.index), self.matched)
+        if self.duplicates:
+            summary += ', %d duplicate sln docids ignored' % self.duplicates
+        if self.orphans:
+            summary += ', %d evt entries with %d docids not found in sln table' % (sum(self.orphans.values()), len(self.orphans))
+        return(summary)
@@ -0,0 +1,28 @@
+###############################################################################
+#
+# Library entry point for libmsot: open a .tbl file as the matching table
+# object, identified by its header.
+#
+###############################################################################
+
+from sln_tbl_parse import *
+from evt_tbl_parse import *
+from user_tbl_parse import *
+
+
+# Table class for each tbl type
+tbl_table_classes = {'sln': slnTable, 'evt': evtTable, 'user': userTable}
+
+
+def open_tbl(path, tbl_type=None, use_mmap=True):
+    ''' Open the .tbl file at path and return an slnTable, evtTable or userTable for it. The type is taken from
+        the 16-byte header, which is all that is read up front: the file is memory-mapped (or read, with
+        use_mmap=False) and the table parses its entries when they are first iterated. If tbl_type is given the
+        file must be of that type.
+
+        Raises tblSignatureError if the file is not a .tbl file, tblTypeError if its type is unknown or is not
+        tbl_type (both are tblFormatErrors, a subclass of ValueError), and OSError if it cannot be read. Nothing
+        is printed and the process is never exited, so this is safe to use in a long-running process. '''
+
+    tbl_type = sniff_tbl_type(path, tbl_type)
+    return(tbl_table_classes[tbl_type](open_tbl_buffer(path, use_mmap)))
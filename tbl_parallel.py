@@ -0,0 +1,203 @@
+###############################################################################
+#
+# Parallel parsing of large sln.tbl and evt.tbl files. The blocks of the
+# file are split into chunks, each parsed by a worker process that maps the
+# same file read-only. Workers write their results as flat NumPy columns
+# into shared memory segments created by the parent, which only receives a
+# short description of each chunk's columns; no entries are pickled. The
+# parent then joins the chunks, in file order, into one slnColumns or
+# evtColumns.
+#
+# sln.tbl gains the most, since most of its parse time is decoding UTF-16
+# strings. The evt.tbl blocks are only copied into columns, so that is
+# bound by memory bandwidth rather than by the number of cores.
+#
+# Requires Python 3.8 or later (multiprocessing.shared_memory).
+#
+###############################################################################
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from misc_functions import open_tbl_buffer
+from sln_tbl_parse import slnTable
+from evt_tbl_parse import evtTable, evt_event_codes
+from tbl_schema import evt_header_size, evt_block_size, sln_layouts
+from tbl_records import evtColumns, slnColumns, slnRecord, docids_to_hex
+from tbl_cache import encode_strings, decode_strings
+
+
+# Blocks per task. Several tasks per worker keep the workers busy when some chunks take longer.
+sln_chunk_blocks = 4096
+evt_chunk_blocks = 1 << 20
+
+# Item type names, by the code stored in the item_type column of a chunk
+sln_item_type_names = sorted(sln_layouts)
+
+# Upper bound of the shared memory used by one sln entry: offset, item type code, docid, and each string field
+# as UTF-8 (at most 3 bytes per UTF-16 code unit) plus a separator. Pages that are not written are not allocated.
+sln_entry_bound = 8 + 1 + 16 + max(sum(stop - start for start, stop in layout.strings.values()) * 3 // 2
+                                   for layout in sln_layouts.values()) + len(slnRecord._fields)
+
+# Columns of an evt chunk, as (name, dtype), 48 bytes per entry. 8-byte columns come first, so every column is aligned.
+evt_shared_columns = [('offsets', '<i8'), ('timestamps_1', '<u8'), ('timestamps_2', '<u8'), ('docids', 'V16'),
+                      ('entry_nums', '<u4'), ('event_ids', '<u4')]
+
+
+def write_arrays(buffer, arrays):
+    ''' Write (name, array) pairs back to back into buffer. Returns their layout, as (name, dtype, offset, count). '''
+
+    layout = []
+    position = 0
+    for name, array in arrays:
+        array = np.ascontiguousarray(array)
+        np.frombuffer(buffer, dtype=np.uint8, count=array.nbytes, offset=position)[:] = array.view(np.uint8).ravel()
+        layout.append((name, array.dtype.str, position, len(array)))
+        position += array.nbytes
+    return(layout)
+
+
+def read_arrays(buffer, layout):
+    ''' Copy the arrays described by layout (see write_arrays) out of buffer. Returns a dict of name : array. '''
+
+    return({name: np.frombuffer(buffer, dtype=dtype, count=count, offset=offset).copy()
+            for name, dtype, offset, count in layout})
+
+
+def evt_columns_in(buffer, block_count):
+    ''' Return a dict of name : array of the evt columns laid out in buffer for block_count entries. '''
+
+    columns = {}
+    position = 0
+    for name, dtype in evt_shared_columns:
+        columns[name] = np.frombuffer(buffer, dtype=dtype, count=block_count, offset=position)
+        position += columns[name].nbytes
+    return(columns)
+
+
+def parse_sln_chunk(path, offsets, segment_name):
+    ''' Worker: parse the sln blocks at offsets and write their columns into the shared memory segment
+        segment_name. Returns (layout, number of blocks skipped). '''
+
+    table = slnTable(open_tbl_buffer(path))
+    columns = slnColumns.from_entries(table.iter_entries(offsets=offsets.tolist()))
+
+    item_type_codes = {name: code for code, name in enumerate(sln_item_type_names)}
+    arrays = [('offsets', columns.offsets),
+              ('item_type', np.array([item_type_codes[item_type] for item_type in columns.item_type], dtype=np.uint8)),
+              ('docid', np.frombuffer(bytes.fromhex(''.join(columns.docid)), dtype='V16'))]
+    arrays += [(name, encode_strings(getattr(columns, name))) for name in slnRecord._fields[2:]]
+
+    segment = shared_memory.SharedMemory(name=segment_name)
+    try:
+        layout = write_arrays(segment.buf, arrays)
+    finally:
+        segment.close()
+    return(layout, table.skipped)
+
+
+def copy_evt_chunk(path, start_block, stop_block, segment_name, block_count):
+    ''' Worker: copy the fields of evt blocks start_block to stop_block into their place in the columns of the
+        shared memory segment segment_name, which holds block_count entries. '''
+
+    table = evtTable(open_tbl_buffer(path))
+    table.parse_entries(evt_header_size + start_block * evt_block_size)
+    table.records = table.records[:stop_block - start_block]
+
+    segment = shared_memory.SharedMemory(name=segment_name)
+    try:
+        fill_evt_columns(segment.buf, block_count, start_block, stop_block, table)
+    finally:
+        segment.close()
+
+
+def fill_evt_columns(buffer, block_count, start_block, stop_block, table):
+    # The views into buffer are released on return, so the segment can then be closed
+    for name, column in evt_columns_in(buffer, block_count).items():
+        column[start_block:stop_block] = getattr(table, name)
+
+
+def parallel_sln_columns(path, workers=None, chunk_blocks=sln_chunk_blocks):
+
+    ''' Parse the sln.tbl at path across workers processes (one per core by default). Returns an slnColumns
+        holding the same entries as slnTable.columns(), in file order, with the blocks skipped by all the workers
+        in its skipped count. '''
+
+    table = slnTable(open_tbl_buffer(path))
+    # Finding the blocks only reads their signatures, so it is done here, and each chunk is whole blocks
+    offsets = np.fromiter(table.locate_blocks(), dtype=np.int64)
+    chunks = [offsets[start:start + chunk_blocks] for start in range(0, len(offsets), chunk_blocks)]
+
+    if len(chunks) <= 1 or workers == 1:
+        return(table.columns())
+
+    segments = []
+    try:
+        for chunk in chunks:
+            segments.append(shared_memory.SharedMemory(create=True, size=len(chunk) * sln_entry_bound))
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(parse_sln_chunk, [path] * len(chunks), chunks,
+                                        [segment.name for segment in segments]))
+
+        offsets = []
+        fields = {name: [] for name in slnRecord._fields}
+        skipped = 0
+        for segment, (layout, chunk_skipped) in zip(segments, results):
+            skipped += chunk_skipped
+            arrays = read_arrays(segment.buf, layout)
+            count = len(arrays['offsets'])
+            offsets.append(arrays['offsets'])
+            fields['item_type'] += np.array(sln_item_type_names, dtype=object)[arrays['item_type']].tolist()
+            fields['docid'] += docids_to_hex(arrays['docid'])
+            for name in slnRecord._fields[2:]:
+                fields[name] += decode_strings(arrays[name], count)
+
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+
+    return(slnColumns(np.concatenate(offsets), *[fields[name] for name in slnRecord._fields], skipped=skipped))
+
+
+def parallel_evt_columns(path, workers=None, chunk_blocks=evt_chunk_blocks):
+
+    ''' Parse the evt.tbl at path across workers processes (one per core by default). Returns an evtColumns
+        holding the same entries as evtTable.columns(), in file order. '''
+
+    table = evtTable(open_tbl_buffer(path))
+    table.parse_entries()
+    block_count = len(table.records)
+    chunks = [(start, min(start + chunk_blocks, block_count)) for start in range(0, block_count, chunk_blocks)]
+
+    if len(chunks) <= 1 or workers == 1:
+        return(table.columns())
+
+    segment = shared_memory.SharedMemory(create=True, size=block_count * sum(np.dtype(dtype).itemsize
+                                                                              for name, dtype in evt_shared_columns))
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(copy_evt_chunk, [path] * len(chunks), [start for start, stop in chunks],
+                              [stop for start, stop in chunks], [segment.name] * len(chunks),
+                              [block_count] * len(chunks)))
+
+        columns = {name: column.copy() for name, column in evt_columns_in(segment.buf, block_count).items()}
+
+    finally:
+        segment.close()
+        segment.unlink()
+
+    return(evtColumns(columns['offsets'], columns['entry_nums'], columns['timestamps_1'], columns['event_ids'],
+                      columns['docids'], columns['timestamps_2'], evt_event_codes))
+
+
+def parallel_columns(tbl_type, path, workers=None):
+
+    ''' Parse the sln.tbl or evt.tbl at path (tbl_type 'sln' or 'evt') across workers processes. '''
+
+    if tbl_type == 'sln':
+        return(parallel_sln_columns(path, workers))
+    return(parallel_evt_columns(path, workers))
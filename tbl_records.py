@@ -0,0 +1,145 @@
+###############################################################################
+#
+# Record types for parsed .tbl entries.
+#
+# Records are named tuples, so fields can be read by name (entry.docid) as
+# well as by their original list index (entry[1]). For bulk use, evtColumns
+# and slnColumns hold a whole table as parallel NumPy columns instead.
+#
+###############################################################################
+
+from collections import namedtuple
+
+import numpy as np
+
+from misc_functions import filetime_to_datetime, filetimes_to_datetime64
+from tbl_index import evtQueries
+
+
+# sln.tbl entry
+slnRecord = namedtuple('slnRecord', ['item_type', 'docid', 'doc_name', 'doc_path', 'doc_title', 'doc_author',
+                                     'addin_name', 'description'])
+
+# evt.tbl entry. timestamp_1 and timestamp_2 are datetimes, or None if not set.
+evtRecord = namedtuple('evtRecord', ['entry_num', 'timestamp_1', 'event_id', 'event_desc', 'docid', 'timestamp_2'])
+
+# user.tbl record. Versions are (major.minor, revision, build) tuples, processors is (logical, physical),
+# resolution is (width, height) and language is (default ID, default UI ID).
+userRecord = namedtuple('userRecord', ['last_modified', 'user_name', 'short_domain', 'machine_name', 'full_domain',
+                                       'agent_version', 'netshare', 'specs', 'processors', 'cpu', 'ram', 'resolution',
+                                       'os_version', 'language', 'ie_version'])
+
+
+def docids_to_hex(docids):
+    ''' Convert a column of 16-byte docids to a list of hex strings. '''
+
+    docid_hex = np.ascontiguousarray(docids).tobytes().hex()
+    return([docid_hex[pos:pos + 32] for pos in range(0, len(docid_hex), 32)])
+
+
+class evtColumns(evtQueries):
+
+    ''' Column-oriented container for evt.tbl entries: 48 bytes per entry, with no Python object per entry.
+        Timestamps are kept as raw FILETIMEs and docids as 16 raw bytes; both are only converted when a record
+        is read. event_codes maps event IDs to their descriptions. The query methods of evtQueries look entries
+        up by event ID or docid through an evtIndex. '''
+
+    __slots__ = ('offsets', 'entry_nums', 'timestamps_1', 'event_ids', 'docids', 'timestamps_2', 'event_codes',
+                 'index')
+
+    def __init__(self, offsets, entry_nums, timestamps_1, event_ids, docids, timestamps_2, event_codes):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.entry_nums = np.asarray(entry_nums, dtype=np.uint32)
+        self.timestamps_1 = np.asarray(timestamps_1, dtype=np.uint64)
+        self.event_ids = np.asarray(event_ids, dtype=np.uint32)
+        self.docids = np.asarray(docids, dtype='V16')
+        self.timestamps_2 = np.asarray(timestamps_2, dtype=np.uint64)
+        self.event_codes = event_codes
+        self.index = None
+
+    def __len__(self):
+        return(len(self.offsets))
+
+    def __iter__(self):
+        return(self.iter_entries())
+
+    def iter_entries(self, chunk_size=65536):
+        ''' Yield (offset, evtRecord) for each entry, like evtTable.iter_entries. The columns are converted
+            chunk_size entries at a time. '''
+        for start in range(0, len(self.offsets), chunk_size):
+            stop = start + chunk_size
+            event_ids = self.event_ids[start:stop].tolist()
+            # NaT (unset timestamps) converts to None
+            columns = zip(self.entry_nums[start:stop].tolist(),
+                          filetimes_to_datetime64(self.timestamps_1[start:stop]).astype(object),
+                          event_ids,
+                          [self.event_codes.get(event_id, 'Unknown') for event_id in event_ids],
+                          docids_to_hex(self.docids[start:stop]),
+                          filetimes_to_datetime64(self.timestamps_2[start:stop]).astype(object))
+            for offset, entry in zip(self.offsets[start:stop].tolist(), columns):
+                yield (offset, evtRecord._make(entry))
+
+    @property
+    def nbytes(self):
+        return(sum(getattr(self, name).nbytes for name in self.__slots__[:-2]))
+
+    def record(self, index, docid=None):
+        ''' Return entry number index as an evtRecord. '''
+        event_id = int(self.event_ids[index])
+        return(evtRecord(int(self.entry_nums[index]),
+                         filetime_to_datetime(int(self.timestamps_1[index])),
+                         event_id,
+                         self.event_codes.get(event_id, 'Unknown'),
+                         docid if docid is not None else bytes(self.docids[index]).hex(),
+                         filetime_to_datetime(int(self.timestamps_2[index]))))
+
+    def take(self, indices):
+        ''' Return a new evtColumns holding only the entries selected by indices (an index array or boolean mask). '''
+        return(evtColumns(self.offsets[indices], self.entry_nums[indices], self.timestamps_1[indices],
+                          self.event_ids[indices], self.docids[indices], self.timestamps_2[indices], self.event_codes))
+
+
+class slnColumns:
+
+    ''' Column-oriented container for sln.tbl entries. The offsets are a NumPy column and each field is a
+        column holding that field for every entry. skipped is the number of blocks the parse left out (name is
+        only a BOM), or None if it is not known, e.g. for columns loaded from the cache. '''
+
+    __slots__ = ('offsets', 'skipped') + slnRecord._fields
+
+    def __init__(self, offsets, *fields, skipped=None):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.skipped = skipped
+        for name, column in zip(slnRecord._fields, fields):
+            setattr(self, name, np.asarray(column, dtype=object))
+
+    @classmethod
+    def from_entries(cls, entries):
+        ''' Build the columns from an iterable of (offset, sln entry) pairs, such as slnTable.iter_entries(). '''
+        offsets = []
+        fields = [[] for name in slnRecord._fields]
+        for offset, entry in entries:
+            offsets.append(offset)
+            for column, value in zip(fields, entry):
+                column.append(value)
+        return(cls(offsets, *fields))
+
+    def __len__(self):
+        return(len(self.offsets))
+
+    def __iter__(self):
+        return(self.iter_entries())
+
+    def iter_entries(self, lazy=False):
+        ''' Yield (offset, slnRecord) for each entry, like slnTable.iter_entries. The fields are already decoded,
+            so lazy is accepted for compatibility only. '''
+        for index in range(len(self.offsets)):
+            yield (int(self.offsets[index]), self.record(index))
+
+    def record(self, index):
+        ''' Return entry number index as an slnRecord. '''
+        return(slnRecord._make(getattr(self, name)[index] for name in slnRecord._fields))
+
+    def take(self, indices):
+        ''' Return a new slnColumns holding only the entries selected by indices (an index array or boolean mask). '''
+        return(slnColumns(self.offsets[indices], *(getattr(self, name)[indices] for name in slnRecord._fields)))
@@ -0,0 +1,91 @@
+###############################################################################
+#
+# Report generation for libmsot. Rows are joined and written as they are
+# produced, so nothing but the sln index is held in memory.
+#
+###############################################################################
+
+import csv
+import sys
+
+from tbl_join import docidIndex
+
+
+# Columns of the joined report. Each row is:
+# [timestamp, entry_num, event_id, event_desc, doc_id, doc_title, doc_path, doc_type, doc_author, addin_name, desc, user, host]
+report_header = ['Timestamp', 'Entry #', 'Event ID', 'Event Description', 'Document ID', 'Document Title', 'Document Path',
+                 'Document Type', 'Document Author', 'Add-in Name', 'Description', 'User', 'Host']
+
+
+def format_timestamp(timestamp):
+    ''' Format a datetime for the report. Timestamps that were never set (None) are left blank. '''
+
+    if timestamp is None:
+        return('')
+    return(timestamp.strftime('%Y-%m-%d %H:%M:%S.%f'))
+
+
+def user_host(user_record):
+    ''' Return the (user, host) pair that is added to every row, from a parsed userTable record. '''
+
+    user = user_record[1]
+    host = user_record[3] + "." + user_record[4]
+    return(user, host)
+
+
+def iter_report_rows(sln_table, evt_table, user_table, include_orphans=False, join=None):
+    ''' Join the evt entries to their sln entries by docid, yielding one report row per evt entry in evt file order.
+        The sln table is indexed first; the evt table is then streamed through the index. With include_orphans,
+        evt entries with no sln entry are included with blank document fields. join is an optional docidIndex,
+        which can be passed in to read the join summary afterwards. '''
+
+    user, host = user_host(next(user_table.iter_entries()))
+
+    if join is None:
+        join = docidIndex()
+    # The sln strings are only decoded for entries that some evt entry refers to
+    join.build(sln_table.iter_entries(lazy=True))
+
+    for sln_entry, evt_offset, evt_entry in join.probe(evt_table.iter_entries(), outer=include_orphans):
+        yield report_row(sln_entry, evt_entry, user, host)
+
+
+def report_row(sln_entry, evt_entry, user, host):
+    ''' Return the report row of an evt entry joined to its sln entry (None for an orphan). '''
+
+    # evt entry: [entry_num, timestamp 1, event_id, event_desc, GUID, timestamp 2]
+    row = [format_timestamp(evt_entry[5]), evt_entry[0], evt_entry[2], evt_entry[3], evt_entry[4]]
+
+    if sln_entry is None:
+        # Orphaned evt entry. Only the docid is known.
+        return(row + ['', '', '', '', '', '', user, host])
+
+    # sln entry: [type, doc_id, doc_name, doc_path, doc_title, doc_author, addin_name, description]
+    doc_path = sln_entry[3] + "\\" + sln_entry[2]
+    return(row + [sln_entry[4], doc_path, sln_entry[0], sln_entry[5], sln_entry[6], sln_entry[7], user, host])
+
+
+def write_csv_report(rows, outfile_name, append=False, header=True, columns=report_header):
+    ''' Write report rows to a csv file as they are produced. An outfile_name of - writes to stdout. With append,
+        rows are added to the end of an existing file, and the header row is only written if the file is empty.
+        columns is the header row. '''
+
+    if outfile_name == '-':
+        csvfile = sys.stdout
+    else:
+        csvfile = open(outfile_name, 'a' if append else 'w', newline='')
+        if append and csvfile.tell() > 0:
+            header = False
+
+    try:
+        writer = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        # Write the header row
+        if header:
+            writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+    finally:
+        if csvfile is not sys.stdout:
+            csvfile.close()
+        else:
+            csvfile.flush()
@@ -0,0 +1,201 @@
+###############################################################################
+#
+# Record layouts of the .tbl tables. Each layout is declared once, as a
+# list of fields, and compiled into a struct.Struct for its numeric fields,
+# a NumPy dtype for whole-table mapping, and the locations of its UTF-16LE
+# string fields. The offsets follow
+# Documentation/Microsoft Office Telemetry Log (TBL) Format.md.
+#
+# Supporting another version of the format means declaring its layouts
+# here; the parsers only refer to fields by name.
+#
+###############################################################################
+
+import struct
+
+import numpy as np
+
+
+# Field kinds: struct format code (None for strings and raw bytes) and NumPy type
+# u16, u32, u64   little-endian unsigned integers
+# filetime        FILETIME, as a little-endian u64
+# utf16           NUL terminated UTF-16LE string, decoded with misc_functions.decode_utf16
+# raw             opaque bytes, kept as they are (e.g. GUIDs)
+field_kinds = {
+    'u16':      ('H', '<u2'),
+    'u32':      ('I', '<u4'),
+    'u64':      ('Q', '<u8'),
+    'filetime': ('Q', '<u8'),
+    'utf16':    (None, None),
+    'raw':      (None, None),
+}
+
+
+class recordLayout:
+
+    ''' A fixed-size record layout, declared as a list of (name, offset, size, kind) fields. Offsets are from the
+        start of the record. Compiled on creation into:
+            numeric   names of the integer and FILETIME fields, in offset order
+            unpacker  struct.Struct reading all numeric fields in one call
+            dtype     NumPy dtype of the whole record (numeric fields and raw fields as void)
+            strings   string field name : (start, stop) '''
+
+    def __init__(self, name, size, fields):
+
+        self.name = name
+        self.size = size
+        self.fields = {field[0]: field for field in fields}
+
+        self.strings = {name: (offset, offset + length) for name, offset, length, kind in fields if kind == 'utf16'}
+
+        numeric = sorted((field for field in fields if field_kinds[field[3]][0]), key=lambda field: field[1])
+        self.numeric = tuple(field[0] for field in numeric)
+
+        # Pad bytes skip the gaps between numeric fields
+        unpack_format = '<'
+        position = 0
+        for name, offset, length, kind in numeric:
+            if offset < position:
+                raise ValueError('%s: field %s overlaps the previous numeric field' % (self.name, name))
+            unpack_format += 'x' * (offset - position) + field_kinds[kind][0]
+            position = offset + length
+        self.unpacker = struct.Struct(unpack_format)
+
+        mapped = [field for field in fields if field[3] != 'utf16']
+        self.dtype = np.dtype({'names': [field[0] for field in mapped],
+                               'formats': [field_kinds[field[3]][1] or 'V%d' % field[2] for field in mapped],
+                               'offsets': [field[1] for field in mapped],
+                               'itemsize': size})
+
+    def unpack(self, buffer, offset=0):
+
+        ''' Return a dict of numeric field : value for the record at offset. Fields beyond the end of a truncated
+            record read as 0. '''
+
+        if len(buffer) - offset < self.unpacker.size:
+            buffer = bytes(buffer[offset:]).ljust(self.unpacker.size, b'\x00')
+            offset = 0
+        return(dict(zip(self.numeric, self.unpacker.unpack_from(buffer, offset))))
+
+    def string_slices(self, buffer, offset=0):
+
+        ''' Return a dict of string field : undecoded bytes for the record at offset. '''
+
+        return({name: buffer[offset + start:offset + stop] for name, (start, stop) in self.strings.items()})
+
+    def raw(self, buffer, name, offset=0):
+
+        ''' Return the bytes of field name of the record at offset. '''
+
+        start, length = self.fields[name][1:3]
+        return(buffer[offset + start:offset + start + length])
+
+
+###############################################################################
+# TBL header. The first 8 bytes are common to all TBL files, the second 8
+# bytes identify the table.
+###############################################################################
+
+tbl_header_size = 16
+tbl_signature = bytes.fromhex('2000000053444454')
+tbl_type_signatures = {
+    bytes.fromhex('01000000564e4953'): 'sln',
+    bytes.fromhex('01000000544e5645'): 'evt',
+    bytes.fromhex('0100000052455355'): 'user',
+}
+
+
+###############################################################################
+# user.tbl: a single record
+###############################################################################
+
+user_layout = recordLayout('user', 2406, [
+    ('last_modified',      36,   8,   'filetime'),
+    ('user_name',          44,   514, 'utf16'),
+    ('short_domain',       558,  552, 'utf16'),
+    ('machine_name',       1124, 32,  'utf16'),
+    ('full_domain',        1156, 514, 'utf16'),
+    ('agent_minor',        1668, 2,   'u16'),
+    ('agent_major',        1670, 2,   'u16'),
+    ('agent_revision',     1672, 2,   'u16'),
+    ('agent_build',        1674, 2,   'u16'),
+    ('netshare',           1676, 520, 'utf16'),
+    ('specs',              2196, 160, 'utf16'),
+    ('logical_processors', 2356, 4,   'u32'),
+    ('physical_processors', 2360, 4,  'u32'),
+    ('cpu',                2364, 4,   'u32'),
+    ('ram',                2368, 4,   'u32'),
+    ('screen_height',      2372, 4,   'u32'),
+    ('screen_width',       2376, 4,   'u32'),
+    ('os_minor',           2380, 2,   'u16'),
+    ('os_major',           2382, 2,   'u16'),
+    ('os_product_type',    2384, 2,   'u16'),
+    ('os_build',           2386, 2,   'u16'),
+    ('ui_language',        2388, 2,   'u16'),
+    ('language',           2392, 2,   'u16'),
+    ('ie_minor',           2396, 2,   'u16'),
+    ('ie_major',           2398, 2,   'u16'),
+    ('ie_revision',        2400, 2,   'u16'),
+    ('ie_build',           2402, 2,   'u16'),
+])
+
+
+###############################################################################
+# evt.tbl: fixed-stride 156-byte blocks from offset 40. Regions that have
+# not been identified yet are kept as raw fields.
+###############################################################################
+
+evt_header_size = 40
+evt_block_size = 156
+
+evt_layout = recordLayout('evt', evt_block_size, [
+    ('block_size',  0,   4,  'u32'),
+    ('entry_num',   4,   4,  'u32'),
+    ('unknown_1',   8,   16, 'raw'),
+    ('timestamp_1', 24,  8,  'filetime'),
+    ('unknown_2',   32,  4,  'raw'),
+    ('event_id',    36,  4,  'u32'),
+    ('guid',        40,  16, 'raw'),
+    ('unknown_3',   56,  80, 'raw'),
+    ('timestamp_2', 136, 8,  'filetime'),
+    ('flags',       144, 8,  'u64'),
+    ('footer',      152, 4,  'u32'),
+])
+
+
+###############################################################################
+# sln.tbl: 2,964-byte blocks from offset 32. Each block starts with its
+# length (0x0b94), which doubles as the block signature. The layout of the
+# string fields depends on the item type at bytes 1116 - 1119.
+###############################################################################
+
+sln_header_size = 32
+sln_block_size = 2964
+sln_block_signature = b'\x94\x0b\x00\x00'
+
+# Fields common to every item type
+sln_common_fields = [
+    ('block_size', 0,    4,   'u32'),
+    ('docid',      4,    16,  'raw'),
+    ('doc_name',   48,   520, 'utf16'),
+    ('doc_path',   568,  520, 'utf16'),
+    ('item_type',  1116, 4,   'u32'),
+]
+
+sln_layouts = {
+    'user_document': recordLayout('user_document', sln_block_size, sln_common_fields + [
+        ('doc_title',   1144, 258, 'utf16'),
+        ('doc_author',  1402, 270, 'utf16'),
+    ]),
+    'application_dll': recordLayout('application_dll', sln_block_size, sln_common_fields + [
+        ('addin_name',  1156, 72,  'utf16'),
+        ('doc_title',   1672, 132, 'utf16'),
+        ('description', 2192, 514, 'utf16'),
+        ('doc_author',  2706, 257, 'utf16'),
+    ]),
+}
+# Blocks of an unknown item type are read with the user_document layout
+sln_layouts['Unknown'] = sln_layouts['user_document']
+
+# Value of the item_type field : item type name
+sln_item_types = {0xffffffff: 'user_document', 0x00000009: 'application_dll'}
@@ -0,0 +1,192 @@
+###############################################################################
+#
+# Document sessions for libmsot. The evt entries of each document are
+# sorted once, by docid, FILETIME (timestamp 2) and entry number, then
+# paired into sessions in one pass:
+#
+#   1  Document loaded successfully         starts a session
+#   14 Application session extended         continues it (or starts one whose
+#                                           load was not logged)
+#   13 Document closed successfully         ends it
+#   11, 12, 16 (crashes)                    are recorded and end it
+#
+# Other event IDs are counted in the open session, and left out when no
+# session is open. Entries whose timestamp was never set cannot be placed
+# in time and are left out.
+#
+###############################################################################
+
+from collections import namedtuple
+
+import numpy as np
+
+from misc_functions import filetime_to_datetime
+from tbl_join import docidIndex
+from tbl_records import docids_to_hex
+from tbl_report import format_timestamp, user_host
+
+
+session_open_ids = {1}
+session_extend_ids = {14}
+session_close_ids = {13}
+session_crash_ids = {11, 12, 16}
+
+# How a session ended:
+#   closed    by a "Document closed successfully" event
+#   crashed   by a crash event
+#   reopened  the document was loaded again before the session was closed
+#   open      no later event for the document; end is the last event seen
+session_statuses = ('closed', 'crashed', 'reopened', 'open')
+
+# A session. start and end are FILETIMEs, and start_id is the event ID that started it (1, or 14 or a crash
+# if the load was not logged). events is the number of evt entries in the session and crashes a list of
+# (event_id, FILETIME) of its crash events.
+docSession = namedtuple('docSession', ['docid', 'start', 'end', 'status', 'start_id', 'start_entry', 'end_entry',
+                                       'events', 'crashes'])
+
+# Columns of the sessions report
+session_header = ['Document ID', 'Document Title', 'Document Path', 'Document Type', 'Start', 'End', 'Duration (s)',
+                  'Status', 'Start Event ID', 'Start Entry #', 'End Entry #', 'Events', 'Crashes', 'User', 'Host']
+
+
+def session_order(evt_table):
+    ''' Return the indices of the evt entries with a timestamp, sorted by docid, timestamp 2 and entry number. '''
+
+    timestamps = np.asarray(evt_table.timestamps_2)
+    selected = np.flatnonzero(timestamps != 0)
+    docids = np.ascontiguousarray(evt_table.docids).view('S16')[selected]
+    # np.lexsort sorts by the last key first
+    return(selected[np.lexsort((np.asarray(evt_table.entry_nums)[selected], timestamps[selected], docids))])
+
+
+class sessionBuilder:
+
+    ''' Pairs the evt entries of a table into docSessions, and counts what was left out. '''
+
+    def __init__(self):
+
+        # Number of sessions, by status
+        self.statuses = dict.fromkeys(session_statuses, 0)
+        # evt entries with no timestamp, and evt entries outside any session (e.g. a close with no session to close)
+        self.untimed = 0
+        self.outside = 0
+
+    def iter_sessions(self, evt_table):
+
+        ''' Generator yielding the docSessions of a parsed evtTable (or evtColumns), grouped by docid and in start
+            order within each docid. '''
+
+        if not getattr(evt_table, 'parsed', True):
+            evt_table.parse_entries()
+
+        order = session_order(evt_table)
+        self.untimed += len(evt_table.event_ids) - len(order)
+
+        docids = docids_to_hex(np.asarray(evt_table.docids)[order])
+        timestamps = np.asarray(evt_table.timestamps_2)[order].tolist()
+        event_ids = np.asarray(evt_table.event_ids)[order].tolist()
+        entry_nums = np.asarray(evt_table.entry_nums)[order].tolist()
+
+        # The open session of the current docid, as a list of docSession fields
+        session = None
+        for docid, timestamp, event_id, entry_num in zip(docids, timestamps, event_ids, entry_nums):
+
+            if session is not None and docid != session[0]:
+                # No later events for the previous document
+                yield self.finish(session, 'open')
+                session = None
+
+            if event_id in session_open_ids:
+                if session is not None:
+                    yield self.finish(session, 'reopened')
+                session = [docid, timestamp, timestamp, None, event_id, entry_num, entry_num, 1, []]
+                continue
+
+            if session is None:
+                if event_id not in session_extend_ids and event_id not in session_crash_ids:
+                    self.outside += 1
+                    continue
+                # The load was not logged; the session starts at the extension or crash
+                session = [docid, timestamp, timestamp, None, event_id, entry_num, entry_num, 0, []]
+
+            session[2] = timestamp
+            session[6] = entry_num
+            session[7] += 1
+
+            if event_id in session_close_ids:
+                yield self.finish(session, 'closed')
+                session = None
+            elif event_id in session_crash_ids:
+                session[8].append((event_id, timestamp))
+                yield self.finish(session, 'crashed')
+                session = None
+
+        if session is not None:
+            yield self.finish(session, 'open')
+
+    def finish(self, session, status):
+        session[3] = status
+        self.statuses[status] += 1
+        return(docSession._make(session))
+
+    def summary(self):
+
+        ''' Return a short, human readable summary of the sessions built. '''
+
+        summary = '%d sessions (%s)' % (sum(self.statuses.values()),
+                                        ', '.join('%d %s' % (self.statuses[status], status) for status in session_statuses))
+        if self.untimed:
+            summary += ', %d evt entries without a timestamp left out' % self.untimed
+        if self.outside:
+            summary += ', %d evt entries outside any session' % self.outside
+        return(summary)
+
+
+def format_crashes(crashes):
+    ''' Format the crash events of a session as "event_id@timestamp" separated by semicolons. '''
+
+    return(';'.join('%d@%s' % (event_id, format_timestamp(filetime_to_datetime(timestamp)))
+                    for event_id, timestamp in crashes))
+
+
+def iter_session_rows(sln_table, evt_table, user_table, include_orphans=False, join=None, builder=None):
+    ''' Yield one sessions report row per docSession of evt_table, with the document fields of its sln entry.
+        Sessions of documents with no sln entry are left out, or with include_orphans are included with blank
+        document fields. join (a docidIndex) and builder (a sessionBuilder) can be passed in to read their
+        summaries afterwards. '''
+
+    user, host = user_host(next(user_table.iter_entries()))
+
+    if join is None:
+        join = docidIndex()
+    if builder is None:
+        builder = sessionBuilder()
+    join.build(sln_table.iter_entries(lazy=True))
+
+    # Sessions are grouped by docid, so the document fields are only looked up once per document
+    docid = found = document = None
+    for session in builder.iter_sessions(evt_table):
+
+        if session.docid != docid:
+            docid = session.docid
+            found = join.index.get(docid)
+            if found is None:
+                document = ['', '', '']
+            else:
+                # sln entry: [type, doc_id, doc_name, doc_path, doc_title, ...]
+                sln_entry = found[1]
+                document = [sln_entry[4], sln_entry[3] + "\\" + sln_entry[2], sln_entry[0]]
+
+        if found is None:
+            join.orphans[docid] += session.events
+            if not include_orphans:
+                continue
+        else:
+            join.matched += session.events
+
+        yield ([session.docid] + document +
+               [format_timestamp(filetime_to_datetime(session.start)),
+                format_timestamp(filetime_to_datetime(session.end)),
+                '%.6f' % ((session.end - session.start) / 10000000),
+                session.status, session.start_id, session.start_entry, session.end_entry, session.events,
+                format_crashes(session.crashes), user, host])
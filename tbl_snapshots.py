@@ -0,0 +1,276 @@
+###############################################################################
+#
+# Delta reports across snapshots of one Telemetry folder, e.g. versions
+# recovered from Volume Shadow Copies or backups, given oldest first.
+#
+# Every evt and sln block of every snapshot is fingerprinted from its raw
+# bytes, without decoding it. For each snapshot only the records whose
+# block is not in the previous snapshot (added) or is no longer there
+# (removed) are decoded and reported, so N snapshots cost about one full
+# parse and N cheap diffs. The first snapshot is reported in full, as added.
+#
+# sln records are decoded once per unique block across all snapshots, and
+# reused by later snapshots to join their changed evt records.
+#
+###############################################################################
+
+import csv
+import sys
+
+import numpy as np
+
+from misc_functions import as_buffer
+from tbl_batch import find_profile_files, profile_directory
+from tbl_open import open_tbl
+from tbl_report import report_header, report_row, user_host
+from tbl_schema import evt_header_size, evt_block_size, sln_block_size
+
+
+# Snapshot reports have three extra columns: the snapshot folder, the change (added or removed) and the table the
+# record is from (evt or sln). sln rows only fill in the document columns.
+snapshot_header = ['Snapshot', 'Change', 'Table'] + report_header
+
+# A block fingerprint is two 64-bit hashes, each the sum of the block's 32-bit words times random 64-bit
+# multipliers. The multipliers are fixed, so fingerprints are the same from run to run.
+fingerprint_dtype = np.dtype([('h1', '<u8'), ('h2', '<u8')])
+fingerprint_multipliers = {}
+
+# Blocks fingerprinted at a time, to bound the size of the temporary arrays
+fingerprint_chunk_bytes = 16 << 20
+
+
+def get_multipliers(words):
+    if words not in fingerprint_multipliers:
+        random_state = np.random.RandomState(words)
+        fingerprint_multipliers[words] = random_state.randint(0, np.iinfo(np.uint64).max, size=(words, 2),
+                                                              dtype=np.uint64)
+    return(fingerprint_multipliers[words])
+
+
+def fingerprint_blocks(blocks):
+    ''' Return the fingerprints of a 2-D uint8 array of blocks, one block per row. The block size must be a
+        multiple of 4. '''
+
+    words = blocks.view('<u4').astype(np.uint64)
+    # uint64 arithmetic wraps around, which makes each hash a sum modulo 2 ** 64
+    hashes = np.dot(words, get_multipliers(words.shape[1]))
+    fingerprints = np.empty(len(blocks), dtype=fingerprint_dtype)
+    fingerprints['h1'] = hashes[:, 0]
+    fingerprints['h2'] = hashes[:, 1]
+    return(fingerprints)
+
+
+def evt_fingerprints(evt_table):
+    ''' Return the fingerprints of the blocks of a parsed evtTable, in block order. '''
+
+    content = np.frombuffer(evt_table.infile_content, dtype=np.uint8)
+    start = evt_header_size + evt_table.first_block * evt_block_size
+    blocks = content[start:start + len(evt_table.records) * evt_block_size].reshape(-1, evt_block_size)
+
+    step = max(fingerprint_chunk_bytes // evt_block_size, 1)
+    return(np.concatenate([fingerprint_blocks(blocks[row:row + step]) for row in range(0, len(blocks), step)]
+                          or [np.empty(0, dtype=fingerprint_dtype)]))
+
+
+def sln_fingerprints(sln_table, offsets):
+    ''' Return the fingerprints of the sln blocks at offsets (an int64 array). Each block must be whole. '''
+
+    content = np.frombuffer(sln_table.infile_content, dtype=np.uint8)
+    if len(offsets) and offsets.max() + sln_block_size > len(content):
+        raise ValueError('sln block at offset %d runs past the end of the file' % offsets.max())
+    block_range = np.arange(sln_block_size)
+
+    step = max(fingerprint_chunk_bytes // sln_block_size, 1)
+    return(np.concatenate([fingerprint_blocks(content[offsets[row:row + step, None] + block_range])
+                           for row in range(0, len(offsets), step)]
+                          or [np.empty(0, dtype=fingerprint_dtype)]))
+
+
+def fingerprint_diff(old, new):
+    ''' Compare two arrays of fingerprints. Returns (added, removed): boolean masks of the fingerprints of new that
+        are not in old, and of those of old that are not in new. Both arrays are sorted together once, so equal
+        fingerprints are next to each other. '''
+
+    keys = np.concatenate([old, new])
+    in_new = np.arange(len(keys)) >= len(old)
+
+    order = np.lexsort((keys['h2'], keys['h1']))
+    keys = keys[order]
+    in_new = in_new[order]
+
+    # Runs of equal fingerprints; group is the run number of each sorted fingerprint
+    starts = np.ones(len(keys), dtype=bool)
+    starts[1:] = (keys['h1'][1:] != keys['h1'][:-1]) | (keys['h2'][1:] != keys['h2'][:-1])
+    group = np.cumsum(starts) - 1
+    group_in_old = np.zeros(len(keys), dtype=bool)
+    group_in_new = np.zeros(len(keys), dtype=bool)
+    group_in_old[group[~in_new]] = True
+    group_in_new[group[in_new]] = True
+
+    changed = np.empty(len(keys), dtype=bool)
+    changed[order] = np.where(in_new, ~group_in_old[group], ~group_in_new[group])
+    return(changed[len(old):], changed[:len(old)])
+
+
+class tblSnapshot:
+
+    ''' The tables of one snapshot, with the fingerprints of their blocks. sln blocks whose name is only a BOM
+        are ignored, as by slnTable.iter_entries. '''
+
+    def __init__(self, profile):
+
+        self.directory = profile_directory(profile)
+        profile_files = profile if isinstance(profile, dict) else find_profile_files(self.directory)
+
+        self.sln_table = open_tbl(profile_files['sln'], 'sln')
+        self.evt_table = open_tbl(profile_files['evt'], 'evt')
+        self.evt_table.parse_entries()
+        self.user, self.host = user_host(next(open_tbl(profile_files['user'], 'user').iter_entries()))
+
+        content = as_buffer(self.sln_table.infile_content)
+        # Only whole blocks are fingerprinted; a partial block at the end of the file is left out
+        self.sln_offsets = np.array([offset for offset in self.sln_table.locate_blocks()
+                                     if offset + sln_block_size <= len(content)
+                                     and content[offset + 48:offset + 52] != b'\xff\xfe\x00\x00'], dtype=np.int64)
+
+        self.sln_fingerprints = sln_fingerprints(self.sln_table, self.sln_offsets)
+        self.evt_fingerprints = evt_fingerprints(self.evt_table)
+
+        # docid : sln record, filled in by snapshotDiff.documents
+        self.documents = None
+
+
+class snapshotDiff:
+
+    ''' Compares each snapshot with the previous one. Decoded sln records are kept by fingerprint, so each
+        unique sln block is only decoded once. '''
+
+    def __init__(self, include_orphans=False):
+
+        self.include_orphans = include_orphans
+        # (h1, h2) : slnRecord
+        self.sln_records = {}
+        self.previous = None
+        # Counts of the last compare: sln added, sln removed, evt added, evt removed, sln blocks decoded
+        self.changes = None
+
+        # Totals over all snapshots
+        self.snapshots = 0
+        self.blocks = 0
+        self.decoded = 0
+
+    def documents(self, snapshot):
+
+        ''' Return a dict of docid : sln record for a snapshot, decoding only the blocks not seen before. '''
+
+        if snapshot.documents is None:
+            keys = list(zip(snapshot.sln_fingerprints['h1'].tolist(), snapshot.sln_fingerprints['h2'].tolist()))
+            new = [index for index, key in enumerate(keys) if key not in self.sln_records]
+
+            offsets = snapshot.sln_offsets[new].tolist()
+            for index, (offset, sln_entry) in zip(new, snapshot.sln_table.iter_entries(offsets=offsets)):
+                self.sln_records[keys[index]] = sln_entry
+            self.decoded += len(new)
+
+            # The first entry of a docid is kept, as by docidIndex
+            snapshot.documents = {}
+            for key in keys:
+                sln_entry = self.sln_records[key]
+                snapshot.documents.setdefault(sln_entry[1], sln_entry)
+
+        return(snapshot.documents)
+
+    def sln_row(self, directory, change, snapshot, sln_entry):
+        ''' Return the row reported under directory for an sln entry of a snapshot. '''
+        # sln entry: [type, doc_id, doc_name, doc_path, doc_title, doc_author, addin_name, description]
+        return([directory, change, 'sln', '', '', '', '', sln_entry[1], sln_entry[4],
+                sln_entry[3] + "\\" + sln_entry[2], sln_entry[0], sln_entry[5], sln_entry[6], sln_entry[7],
+                snapshot.user, snapshot.host])
+
+    def evt_rows(self, directory, change, snapshot, indices):
+        ''' Yield the rows reported under directory for the evt entries at indices of a snapshot. '''
+
+        documents = self.documents(snapshot)
+        for evt_offset, evt_entry in snapshot.evt_table.take(indices).iter_entries():
+            sln_entry = documents.get(evt_entry[4])
+            if sln_entry is None and not self.include_orphans:
+                continue
+            yield [directory, change, 'evt'] + report_row(sln_entry, evt_entry, snapshot.user, snapshot.host)
+
+    def compare(self, snapshot):
+
+        ''' Generator yielding the rows of the records of snapshot that were added or removed since the previous
+            snapshot given to compare, then making snapshot the previous one. The counts are then in self.changes. '''
+
+        previous = self.previous
+        if previous is None:
+            sln_added = np.ones(len(snapshot.sln_fingerprints), dtype=bool)
+            evt_added = np.ones(len(snapshot.evt_fingerprints), dtype=bool)
+            sln_removed = evt_removed = np.zeros(0, dtype=bool)
+        else:
+            sln_added, sln_removed = fingerprint_diff(previous.sln_fingerprints, snapshot.sln_fingerprints)
+            evt_added, evt_removed = fingerprint_diff(previous.evt_fingerprints, snapshot.evt_fingerprints)
+
+        decoded = self.decoded
+        self.documents(snapshot)
+
+        # Documents first, then the events removed since the previous snapshot, then the new events. Removed
+        # records are read from the previous snapshot, but reported under this one.
+        for changed, change, mask in ((previous, 'removed', sln_removed), (snapshot, 'added', sln_added)):
+            if mask.any():
+                for key in zip(changed.sln_fingerprints['h1'][mask].tolist(),
+                               changed.sln_fingerprints['h2'][mask].tolist()):
+                    yield self.sln_row(snapshot.directory, change, changed, self.sln_records[key])
+
+        if evt_removed.any():
+            yield from self.evt_rows(snapshot.directory, 'removed', previous, np.flatnonzero(evt_removed))
+        yield from self.evt_rows(snapshot.directory, 'added', snapshot, np.flatnonzero(evt_added))
+
+        self.snapshots += 1
+        self.blocks += len(snapshot.sln_fingerprints) + len(snapshot.evt_fingerprints)
+        self.previous = snapshot
+        self.changes = (int(sln_added.sum()), int(sln_removed.sum()), int(evt_added.sum()), int(evt_removed.sum()),
+                        self.decoded - decoded)
+
+    def summary(self):
+
+        ''' Return a short, human readable summary of the last compare. '''
+
+        return('%d sln entries added, %d removed; %d evt entries added, %d removed; %d sln blocks decoded'
+               % self.changes)
+
+
+def run_snapshots(profiles, outfile_name, include_orphans=False):
+    ''' Write a delta report of a list of snapshots of one Telemetry folder (folders, or dicts of tbl type : path),
+        oldest first, to the csv file outfile_name (or - for stdout). Returns the number of snapshots that could not
+        be parsed; those are left out, and the next snapshot is compared with the last one that could be. '''
+
+    failed = 0
+    diff = snapshotDiff(include_orphans)
+
+    csvfile = sys.stdout if outfile_name == '-' else open(outfile_name, 'w', newline='')
+    try:
+        writer = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        writer.writerow(snapshot_header)
+
+        for profile in profiles:
+            directory = profile_directory(profile)
+            try:
+                snapshot = tblSnapshot(profile)
+            except Exception as error:
+                failed += 1
+                print('%s: %s: %s' % (directory, type(error).__name__, error), file=sys.stderr)
+                continue
+
+            writer.writerows(diff.compare(snapshot))
+            print('%s: %s' % (directory, diff.summary()), file=sys.stderr)
+
+    finally:
+        if csvfile is not sys.stdout:
+            csvfile.close()
+        else:
+            csvfile.flush()
+
+    print('%d snapshots, %d blocks fingerprinted, %d unique sln blocks decoded'
+          % (diff.snapshots, diff.blocks, diff.decoded), file=sys.stderr)
+    return(failed)
@@ -0,0 +1,173 @@
+###############################################################################
+#
+# SQLite output for libmsot. Tables are stored normalized: one row per host
+# (user.tbl), per document (sln.tbl) and per event (evt.tbl).
+#
+###############################################################################
+
+import sqlite3
+
+from tbl_report import format_timestamp, user_host
+
+
+sqlite_schema = '''
+CREATE TABLE IF NOT EXISTS hosts (
+    host_id         INTEGER PRIMARY KEY,
+    user            TEXT NOT NULL,
+    host            TEXT NOT NULL,
+    short_domain    TEXT,
+    machine_name    TEXT,
+    full_domain     TEXT,
+    last_modified   TEXT,
+    UNIQUE (user, host)
+);
+CREATE TABLE IF NOT EXISTS documents (
+    document_id     INTEGER PRIMARY KEY,
+    host_id         INTEGER NOT NULL REFERENCES hosts (host_id),
+    docid           TEXT NOT NULL,
+    doc_type        TEXT,
+    doc_name        TEXT,
+    doc_path        TEXT,
+    doc_title       TEXT,
+    doc_author      TEXT,
+    addin_name      TEXT,
+    description     TEXT,
+    UNIQUE (host_id, docid)
+);
+CREATE TABLE IF NOT EXISTS events (
+    event_row       INTEGER PRIMARY KEY,
+    host_id         INTEGER NOT NULL REFERENCES hosts (host_id),
+    docid           TEXT NOT NULL,
+    entry_num       INTEGER,
+    event_id        INTEGER,
+    event_desc      TEXT,
+    timestamp       TEXT,
+    timestamp_1     TEXT,
+    UNIQUE (host_id, docid, entry_num, timestamp)
+);
+'''
+
+# Query indexes. These are created after loading, so the bulk inserts don't have to maintain them.
+sqlite_indexes = '''
+CREATE INDEX IF NOT EXISTS events_timestamp ON events (timestamp);
+CREATE INDEX IF NOT EXISTS events_docid ON events (docid);
+CREATE INDEX IF NOT EXISTS events_event_id ON events (event_id);
+CREATE INDEX IF NOT EXISTS events_host ON events (host_id);
+CREATE INDEX IF NOT EXISTS documents_docid ON documents (docid);
+CREATE INDEX IF NOT EXISTS hosts_host ON hosts (host);
+'''
+
+
+def iter_batches(rows, batch_size):
+    ''' Split an iterable of rows into lists of at most batch_size rows. '''
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class sqliteSink:
+
+    ''' Write parsed tables into a SQLite database. Existing databases are appended to: hosts and documents already
+        present are reused and events that were already loaded are skipped, so the same profile can be loaded again
+        safely. All inserts of one call run in a single transaction, batch_size rows per executemany. '''
+
+    def __init__(self, database_name, batch_size=10000):
+
+        self.batch_size = batch_size
+        self.connection = sqlite3.connect(database_name)
+        self.connection.executescript(sqlite_schema)
+
+        # Number of rows inserted by this sink
+        self.hosts = 0
+        self.documents = 0
+        self.events = 0
+
+    def host_id(self, user_record):
+
+        ''' Return the host_id for a parsed userTable record, inserting the host if it is new. '''
+
+        user, host = user_host(user_record)
+        cursor = self.connection.execute(
+            'INSERT OR IGNORE INTO hosts (user, host, short_domain, machine_name, full_domain, last_modified) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (user, host, user_record[2], user_record[3], user_record[4], format_timestamp(user_record[0])))
+        self.hosts += cursor.rowcount
+
+        return(self.connection.execute('SELECT host_id FROM hosts WHERE user = ? AND host = ?', (user, host)).fetchone()[0])
+
+    def write_profile(self, sln_table, evt_table, user_table):
+
+        ''' Load the documents of sln_table and the events of evt_table, for the host in user_table. '''
+
+        with self.connection:
+            host_id = self.host_id(next(user_table.iter_entries()))
+
+            # sln entry: [type, doc_id, doc_name, doc_path, doc_title, doc_author, addin_name, description]
+            documents = ((host_id, entry[1], entry[0], entry[2], entry[3], entry[4], entry[5], entry[6], entry[7])
+                         for offset, entry in sln_table.iter_entries())
+            for batch in iter_batches(documents, self.batch_size):
+                cursor = self.connection.executemany(
+                    'INSERT OR IGNORE INTO documents (host_id, docid, doc_type, doc_name, doc_path, doc_title, '
+                    'doc_author, addin_name, description) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', batch)
+                self.documents += cursor.rowcount
+
+            # evt entry: [entry_num, timestamp 1, event_id, event_desc, GUID, timestamp 2]
+            events = ((host_id, entry[4], entry[0], entry[2], entry[3], format_timestamp(entry[5]), format_timestamp(entry[1]))
+                      for offset, entry in evt_table.iter_entries())
+            for batch in iter_batches(events, self.batch_size):
+                cursor = self.connection.executemany(
+                    'INSERT OR IGNORE INTO events (host_id, docid, entry_num, event_id, event_desc, timestamp, '
+                    'timestamp_1) VALUES (?, ?, ?, ?, ?, ?, ?)', batch)
+                self.events += cursor.rowcount
+
+    def merge(self, database_name):
+
+        ''' Append the contents of another database written by sqliteSink (such as a batch mode part), remapping
+            its host_ids onto this database's hosts. '''
+
+        self.connection.execute('ATTACH DATABASE ? AS part', (database_name,))
+        try:
+            with self.connection:
+                cursor = self.connection.execute(
+                    'INSERT OR IGNORE INTO hosts (user, host, short_domain, machine_name, full_domain, last_modified) '
+                    'SELECT user, host, short_domain, machine_name, full_domain, last_modified FROM part.hosts')
+                self.hosts += cursor.rowcount
+
+                cursor = self.connection.execute(
+                    'INSERT OR IGNORE INTO documents (host_id, docid, doc_type, doc_name, doc_path, doc_title, '
+                    'doc_author, addin_name, description) '
+                    'SELECT hosts.host_id, d.docid, d.doc_type, d.doc_name, d.doc_path, d.doc_title, d.doc_author, '
+                    'd.addin_name, d.description FROM part.documents d '
+                    'JOIN part.hosts ph ON ph.host_id = d.host_id '
+                    'JOIN hosts ON hosts.user = ph.user AND hosts.host = ph.host')
+                self.documents += cursor.rowcount
+
+                cursor = self.connection.execute(
+                    'INSERT OR IGNORE INTO events (host_id, docid, entry_num, event_id, event_desc, timestamp, timestamp_1) '
+                    'SELECT hosts.host_id, e.docid, e.entry_num, e.event_id, e.event_desc, e.timestamp, e.timestamp_1 '
+                    'FROM part.events e '
+                    'JOIN part.hosts ph ON ph.host_id = e.host_id '
+                    'JOIN hosts ON hosts.user = ph.user AND hosts.host = ph.host')
+                self.events += cursor.rowcount
+        finally:
+            self.connection.execute('DETACH DATABASE part')
+
+    def summary(self):
+
+        ''' Return a short, human readable summary of what was inserted. '''
+
+        return('%d hosts, %d documents, %d events added' % (self.hosts, self.documents, self.events))
+
+    def close(self):
+
+        ''' Build the query indexes and close the database. '''
+
+        with self.connection:
+            self.connection.executescript(sqlite_indexes)
+        self.connection.close()
@@ -0,0 +1,256 @@
+###############################################################################
+#
+# Instrumentation for libmsot. A tblStats collects, for each phase of a run
+# (read, validate, parse of each table, join, write), the wall time, CPU
+# time, bytes, records and skipped records, and the peak memory of the
+# process. Phases nest: time spent in an inner phase is not counted in the
+# outer one, so the phases of a streamed report add up to the whole run.
+#
+# Embedding code can subscribe to phase events:
+#
+#   stats = tblStats()
+#   stats.subscribe(lambda event, name, phase: print(event, name, phase))
+#
+# The callback is called with event 'start' or 'end', the phase name and
+# the phase's stats dict (see tblStats.as_dict).
+#
+###############################################################################
+
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from evt_tbl_parse import evt_event_codes
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak memory is not reported there
+    resource = None
+
+
+# Skip reasons counted by the parser
+skip_reasons = {
+    'bom_only_name':      'sln entries ignored because their name is only a BOM',
+    'unknown_event_code': 'evt entries with an event ID that has no description',
+    'orphan_docid':       'evt entries whose docid is not in the sln table',
+}
+
+
+def peak_rss():
+    ''' Return the peak resident set size of this process in bytes, or None if it is not available. '''
+
+    if resource is None:
+        return(None)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return(peak if sys.platform == 'darwin' else peak * 1024)
+
+
+def unknown_event_codes(evt_table):
+    ''' Return the number of entries of a parsed evtTable (or evtColumns) whose event ID is not in evt_event_codes. '''
+
+    return(int(np.isin(evt_table.event_ids, list(evt_event_codes), invert=True).sum()))
+
+
+class instrumentedTable:
+
+    ''' Wrapper around a table (slnTable, evtTable, userTable or a column container) whose iter_entries time
+        is recorded as a phase of a tblStats. Other attributes are read from the table. '''
+
+    def __init__(self, table, stats, name):
+        self.table = table
+        self.stats = stats
+        self.name = name
+
+    def __getattr__(self, attribute):
+        return(getattr(self.table, attribute))
+
+    def iter_entries(self, *args, **kwargs):
+        return(self.stats.timed(self.table.iter_entries(*args, **kwargs), self.name))
+
+
+class tblStats:
+
+    ''' Per-phase counters for one run. With enabled=False nothing is recorded and instrument() returns tables
+        unchanged, so callers can use a tblStats unconditionally. '''
+
+    def __init__(self, enabled=True):
+
+        self.enabled = enabled
+        # phase name : stats dict, in the order phases were first entered
+        self.phases = {}
+        self.hooks = []
+
+        # Active phases, innermost last, each as [name, wall time, CPU time] at which it last resumed
+        self.stack = []
+        self.started = time.perf_counter()
+
+    def subscribe(self, callback):
+
+        ''' Call callback(event, name, phase) when a phase starts or ends. '''
+
+        self.hooks.append(callback)
+
+    def emit(self, event, name):
+        for callback in self.hooks:
+            callback(event, name, self.phases[name])
+
+    def get_phase(self, name):
+        if name not in self.phases:
+            self.phases[name] = {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'bytes': 0, 'records': 0,
+                                 'skipped': {}, 'peak_rss': None}
+        return(self.phases[name])
+
+    def enter(self, name):
+
+        ''' Make name the active phase, pausing the enclosing one. '''
+
+        wall, cpu = time.perf_counter(), time.process_time()
+        if self.stack:
+            self.pause(self.stack[-1], wall, cpu)
+        self.stack.append([name, wall, cpu])
+
+    def leave(self):
+
+        ''' Stop the active phase and resume the enclosing one. '''
+
+        wall, cpu = time.perf_counter(), time.process_time()
+        self.pause(self.stack.pop(), wall, cpu)
+        if self.stack:
+            self.stack[-1][1:] = [wall, cpu]
+
+    def pause(self, active, wall, cpu):
+        phase = self.phases[active[0]]
+        phase['wall_seconds'] += wall - active[1]
+        phase['cpu_seconds'] += cpu - active[2]
+
+    def finish(self, name):
+        self.get_phase(name)['peak_rss'] = peak_rss()
+        self.emit('end', name)
+
+    @contextmanager
+    def phase(self, name, nbytes=0):
+
+        ''' Context manager timing the code it wraps as phase name. '''
+
+        if not self.enabled:
+            yield
+            return
+
+        self.get_phase(name)['bytes'] += nbytes
+        self.emit('start', name)
+        self.enter(name)
+        try:
+            yield
+        finally:
+            self.leave()
+            self.finish(name)
+
+    def timed(self, iterable, name):
+
+        ''' Generator yielding the items of iterable, timing each step as phase name and counting each item as a
+            record. Time spent by the consumer between items is not counted. '''
+
+        if not self.enabled:
+            yield from iterable
+            return
+
+        phase = self.get_phase(name)
+        self.emit('start', name)
+        iterator = iter(iterable)
+        try:
+            while True:
+                self.enter(name)
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    self.leave()
+                phase['records'] += 1
+                yield item
+        finally:
+            self.finish(name)
+
+    def instrument(self, table, name):
+
+        ''' Return table with its iter_entries timed as phase name. '''
+
+        if not self.enabled:
+            return(table)
+        return(instrumentedTable(table, self, name))
+
+    def count(self, name, records=0, nbytes=0, **skipped):
+
+        ''' Add records, bytes and skipped records (given as reason=count) to phase name. '''
+
+        if not self.enabled:
+            return
+
+        phase = self.get_phase(name)
+        phase['records'] += records
+        phase['bytes'] += nbytes
+        for reason, number in skipped.items():
+            phase['skipped'][reason] = phase['skipped'].get(reason, 0) + number
+
+    def as_dict(self):
+
+        ''' Return the stats as a dict: the total wall time, the peak memory and the stats of each phase. '''
+
+        return({'wall_seconds': time.perf_counter() - self.started,
+                'cpu_seconds': time.process_time(),
+                'peak_rss': peak_rss(),
+                'phases': self.phases})
+
+    def to_json(self):
+        return(json.dumps(self.as_dict(), indent=2))
+
+    def to_prometheus(self, prefix='msot'):
+
+        ''' Return the stats in the Prometheus text exposition format, for the node_exporter textfile collector. '''
+
+        metrics = [('phase_wall_seconds', 'wall_seconds', 'Wall time spent in each phase.'),
+                   ('phase_cpu_seconds', 'cpu_seconds', 'CPU time spent in each phase.'),
+                   ('phase_bytes', 'bytes', 'Bytes read by each phase.'),
+                   ('phase_records', 'records', 'Records produced by each phase.'),
+                   ('phase_peak_rss_bytes', 'peak_rss', 'Peak resident set size of the process at the end of each phase.')]
+
+        lines = []
+        for metric, key, description in metrics:
+            lines.append('# HELP %s_%s %s' % (prefix, metric, description))
+            lines.append('# TYPE %s_%s gauge' % (prefix, metric))
+            for name, phase in self.phases.items():
+                if phase[key] is not None:
+                    lines.append('%s_%s{phase="%s"} %s' % (prefix, metric, name, phase[key]))
+
+        lines.append('# HELP %s_phase_skipped_records Records skipped by each phase, by reason.' % prefix)
+        lines.append('# TYPE %s_phase_skipped_records gauge' % prefix)
+        for name, phase in self.phases.items():
+            for reason, number in phase['skipped'].items():
+                lines.append('%s_phase_skipped_records{phase="%s",reason="%s"} %d' % (prefix, name, reason, number))
+
+        totals = self.as_dict()
+        lines.append('# HELP %s_run_wall_seconds Wall time of the whole run.' % prefix)
+        lines.append('# TYPE %s_run_wall_seconds gauge' % prefix)
+        lines.append('%s_run_wall_seconds %s' % (prefix, totals['wall_seconds']))
+        return('\n'.join(lines) + '\n')
+
+    def write(self, outfile_name, stats_format='json'):
+
+        ''' Write the stats as 'json' or 'prometheus' to outfile_name, or to stderr if it is -. '''
+
+        text = self.to_prometheus() if stats_format == 'prometheus' else self.to_json() + '\n'
+        if outfile_name == '-':
+            sys.stderr.write(text)
+            return
+
+        # Written to a temporary file first, so a textfile collector never reads a partial file
+        temp_name = outfile_name + '.tmp'
+        with open(temp_name, 'w') as stats_file:
+            stats_file.write(text)
+        os.replace(temp_name, outfile_name)
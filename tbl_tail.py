@@ -0,0 +1,133 @@
+###############################################################################
+#
+# Incremental (tail) parsing of evt.tbl. The telemetry agent appends blocks
+# to evt.tbl; a checkpoint file records how far each evt.tbl has been
+# processed, so only blocks appended since the last run are parsed.
+#
+###############################################################################
+
+import hashlib
+import json
+import os
+import sys
+import time
+
+from sln_tbl_parse import *
+from evt_tbl_parse import *
+from user_tbl_parse import *
+from tbl_join import docidIndex
+from tbl_open import open_tbl
+from tbl_report import iter_report_rows, write_csv_report
+
+
+def block_fingerprint(infile_content, end_offset):
+    ''' Fingerprint of an evt.tbl: a hash of its header and of the last block before end_offset. If either
+        changes, the file has been rewritten or rotated rather than appended to. '''
+
+    fingerprint = hashlib.blake2b(digest_size=16)
+    fingerprint.update(infile_content[0:evt_header_size])
+    if end_offset > evt_header_size:
+        fingerprint.update(infile_content[end_offset - evt_block_size:end_offset])
+    return(fingerprint.hexdigest())
+
+
+class evtCheckpoints:
+
+    ''' Checkpoints for any number of evt.tbl files, persisted as JSON. Each checkpoint is keyed by the absolute
+        path of the file and records:
+            offset       offset just past the last processed block
+            entry_num    entry number of the last processed block
+            fingerprint  block_fingerprint at offset
+            inode        inode number of the file, to detect rotation '''
+
+    def __init__(self, checkpoint_name):
+
+        self.checkpoint_name = checkpoint_name
+        self.checkpoints = {}
+
+        if os.path.exists(checkpoint_name):
+            with open(checkpoint_name, 'r') as checkpoint_file:
+                self.checkpoints = json.load(checkpoint_file)
+
+    def resume_offset(self, evt_name, infile_content):
+
+        ''' Return (offset, reason): the offset to resume parsing evt_name from, and why. The offset is that of the
+            first block if there is no usable checkpoint, in which case the whole file is parsed again. '''
+
+        checkpoint = self.checkpoints.get(os.path.abspath(evt_name))
+        if checkpoint is None:
+            return(evt_header_size, 'no checkpoint')
+
+        if os.stat(evt_name).st_ino != checkpoint['inode']:
+            return(evt_header_size, 'file replaced')
+        if len(infile_content) < checkpoint['offset']:
+            return(evt_header_size, 'file truncated')
+        if block_fingerprint(infile_content, checkpoint['offset']) != checkpoint['fingerprint']:
+            return(evt_header_size, 'file rewritten')
+
+        return(checkpoint['offset'], 'resumed')
+
+    def update(self, evt_name, evt_table):
+
+        ''' Record that evt_table has been processed up to its last parsed block. '''
+
+        offset = evt_table.end_offset
+        checkpoint = self.checkpoints.get(os.path.abspath(evt_name), {})
+
+        # Keep the previous entry number if nothing new was parsed
+        if len(evt_table.records):
+            checkpoint['entry_num'] = int(evt_table.entry_nums[-1])
+        checkpoint.setdefault('entry_num', None)
+        checkpoint['offset'] = offset
+        checkpoint['fingerprint'] = block_fingerprint(evt_table.infile_content, offset)
+        checkpoint['inode'] = os.stat(evt_name).st_ino
+
+        self.checkpoints[os.path.abspath(evt_name)] = checkpoint
+
+    def save(self):
+
+        ''' Write the checkpoints. The file is replaced atomically, so an interrupted save leaves the old one. '''
+
+        temp_name = self.checkpoint_name + '.tmp'
+        with open(temp_name, 'w') as checkpoint_file:
+            json.dump(self.checkpoints, checkpoint_file, indent=2, sort_keys=True)
+        os.replace(temp_name, self.checkpoint_name)
+
+
+def follow_profile(sln_name, evt_name, user_name, outfile_name, checkpoint_name, include_orphans=False, interval=None,
+                   tbl_filter=None):
+    ''' Parse only the evt.tbl blocks appended since the last checkpoint, and append their joined rows to
+        outfile_name (csv, or - for stdout). The sln and user tables are parsed in full each time, since new
+        documents can be added to sln.tbl. If interval is given, poll every interval seconds until interrupted.
+        The checkpoint is only saved after the rows have been written. If tbl_filter is given, only the new
+        blocks it selects are reported; the checkpoint still covers every block read. Each file's header is
+        checked on every poll, as by open_tbl, which raises a tblFormatError if one is not of its type. '''
+
+    checkpoints = evtCheckpoints(checkpoint_name)
+    # When following to stdout, the header is only written once
+    header = True
+
+    while True:
+        sln_table = open_tbl(sln_name, 'sln')
+        evt_table = open_tbl(evt_name, 'evt')
+        user_table = open_tbl(user_name, 'user')
+
+        start_offset, reason = checkpoints.resume_offset(evt_name, evt_table.infile_content)
+        evt_table.parse_entries(start_offset)
+
+        # The checkpoint is kept against the whole table; only the report is filtered
+        report_table = evt_table if tbl_filter is None else tbl_filter.apply(sln_table, evt_table)
+
+        join = docidIndex()
+        write_csv_report(iter_report_rows(sln_table, report_table, user_table, include_orphans, join), outfile_name,
+                         append=True, header=header)
+        header = False
+        print('%s: %s at offset %d, %d new blocks. %s' % (evt_name, reason, start_offset, len(evt_table.records), join.summary()),
+              file=sys.stderr)
+
+        checkpoints.update(evt_name, evt_table)
+        checkpoints.save()
+
+        if interval is None:
+            return
+        time.sleep(interval)
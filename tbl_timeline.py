@@ -0,0 +1,183 @@
+###############################################################################
+#
+# Merged timeline for libmsot batch mode: the joined rows of many profiles
+# in one chronological report, without sorting the whole report at once.
+#
+# Each profile is parsed by a worker process, which sorts its evt entries
+# by raw FILETIME (timestamp 2) in runs of at most run_size entries and
+# writes each sorted run to a temporary file. The runs of all profiles are
+# then merged with a heap (heapq.merge), which holds one row per run. If
+# there are more runs than fan_in, they are first merged in groups into
+# longer runs, so the number of open files stays bounded.
+#
+# Run files are csv, with a sort key column before the report row: the
+# FILETIME, profile number and entry number, zero padded so the keys compare
+# as strings without being parsed. Entries whose timestamp was never set sort
+# after all others.
+#
+###############################################################################
+
+import csv
+import heapq
+import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+
+import numpy as np
+
+from tbl_batch import batch_header, find_profile_files, profile_directory
+from tbl_cache import parseCache
+from tbl_join import docidIndex
+from tbl_open import open_tbl
+from tbl_report import report_row, user_host
+
+
+# Sort key of entries with an unset timestamp, after every real FILETIME
+untimed_key = np.iinfo(np.uint64).max
+
+# Sort key column of a run file: FILETIME, profile number, entry number
+run_key_format = '%020d%06d%010d'
+
+
+def timeline_keys(evt_table):
+    ''' Return the FILETIME sort keys of the entries of an evtTable or evtColumns. '''
+
+    timestamps = np.asarray(evt_table.timestamps_2)
+    return(np.where(timestamps == 0, untimed_key, timestamps))
+
+
+def write_runs(profile, profile_number, run_prefix, include_orphans=False, run_size=1000000, cache_dir=None,
+               cache_bytes=1 << 30, tbl_filter=None):
+    ''' Worker for run_timeline. Parse the tables of one profile (as for tbl_batch.parse_profile), sort its
+        evt entries by timestamp in runs of run_size entries, and write each run, joined to the sln entries,
+        to the file run_prefix-NNNNNN.csv. Returns (directory, run file names, summary, error). '''
+
+    directory = profile_directory(profile)
+
+    try:
+        if isinstance(profile, dict):
+            profile_files = profile
+        else:
+            profile_files = find_profile_files(directory)
+        sln_table = open_tbl(profile_files['sln'], 'sln')
+        evt_table = open_tbl(profile_files['evt'], 'evt')
+        user_table = open_tbl(profile_files['user'], 'user')
+
+        if cache_dir is not None:
+            cache = parseCache(cache_dir, cache_bytes)
+            sln_table = cache.table('sln', profile_files['sln'], sln_table.columns)
+            evt_table = cache.table('evt', profile_files['evt'], evt_table.columns)
+        elif not evt_table.parsed:
+            evt_table.parse_entries()
+
+        if tbl_filter is not None:
+            evt_table = tbl_filter.apply(sln_table, evt_table)
+
+        user, host = user_host(next(user_table.iter_entries()))
+        join = docidIndex().build(sln_table.iter_entries(lazy=True))
+
+        run_names = []
+        for start in range(0, len(evt_table.event_ids), run_size):
+            run = evt_table.take(slice(start, start + run_size))
+            keys = timeline_keys(run)
+            order = np.lexsort((run.entry_nums, keys))
+            run = run.take(order)
+            # The sort key stands in for the offset, which probe passes through unchanged
+            keyed_entries = zip(keys[order].tolist(), (entry for offset, entry in run.iter_entries()))
+
+            run_name = '%s-%06d.csv' % (run_prefix, len(run_names))
+            with open(run_name, 'w', newline='') as run_file:
+                writer = csv.writer(run_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+                for sln_entry, key, evt_entry in join.probe(keyed_entries, outer=include_orphans):
+                    writer.writerow([run_key_format % (key, profile_number, evt_entry[0])]
+                                    + report_row(sln_entry, evt_entry, user, host) + [directory])
+            run_names.append(run_name)
+
+        return(directory, run_names, join.summary(), None)
+
+    except Exception as error:
+        return(directory, [], None, '%s: %s' % (type(error).__name__, error))
+
+
+def merge_runs(run_names, writer, keep_keys=True):
+    ''' Merge sorted run files into one sorted stream of rows, written with writer. Only one row of each run is
+        held in memory. With keep_keys=False the sort key column is dropped. '''
+
+    run_files = [open(run_name, 'r', newline='') for run_name in run_names]
+    try:
+        merged = heapq.merge(*[csv.reader(run_file) for run_file in run_files], key=itemgetter(0))
+        if keep_keys:
+            writer.writerows(merged)
+        else:
+            writer.writerows(row[1:] for row in merged)
+    finally:
+        for run_file in run_files:
+            run_file.close()
+
+
+def merge_all_runs(run_names, writer, part_dir, fan_in=256):
+    ''' Merge any number of sorted run files into writer, at most fan_in at a time. Runs beyond fan_in are first
+        merged in groups into longer runs in part_dir, and so on until fan_in or fewer are left. '''
+
+    level = 0
+    while len(run_names) > fan_in:
+        merged_names = []
+        for group in range(0, len(run_names), fan_in):
+            merged_name = os.path.join(part_dir, 'merge-%d-%06d.csv' % (level, len(merged_names)))
+            with open(merged_name, 'w', newline='') as merged_file:
+                merge_runs(run_names[group:group + fan_in], csv.writer(merged_file, delimiter=',', quotechar='"',
+                                                                      quoting=csv.QUOTE_MINIMAL))
+            for run_name in run_names[group:group + fan_in]:
+                os.remove(run_name)
+            merged_names.append(merged_name)
+        run_names = merged_names
+        level += 1
+
+    merge_runs(run_names, writer, keep_keys=False)
+
+
+def run_timeline(profiles, outfile_name, workers=None, include_orphans=False, cache_dir=None, cache_bytes=1 << 30,
+                 tbl_filter=None, run_size=1000000, fan_in=256):
+    ''' Parse each profile across a pool of worker processes (see write_runs) and merge their rows into one csv
+        report in timestamp order, with the batch report columns. Rows with the same timestamp are in profile
+        order, then entry number order. Memory use depends on the number of runs, not the number of events.
+        Returns the number of profiles that could not be parsed. '''
+
+    failed = 0
+    part_dir = tempfile.mkdtemp(prefix='msot-timeline-')
+
+    try:
+        run_names = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(write_runs, profiles, range(len(profiles)),
+                                   [os.path.join(part_dir, 'run-%06d' % number) for number in range(len(profiles))],
+                                   [include_orphans] * len(profiles), [run_size] * len(profiles),
+                                   [cache_dir] * len(profiles), [cache_bytes] * len(profiles),
+                                   [tbl_filter] * len(profiles))
+
+            for directory, profile_runs, summary, error in results:
+                if error is not None:
+                    failed += 1
+                    print('%s: %s' % (directory, error), file=sys.stderr)
+                    continue
+                print('%s: %s' % (directory, summary), file=sys.stderr)
+                run_names += profile_runs
+
+        csvfile = sys.stdout if outfile_name == '-' else open(outfile_name, 'w', newline='')
+        try:
+            writer = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(batch_header)
+            merge_all_runs(run_names, writer, part_dir, fan_in)
+        finally:
+            if csvfile is not sys.stdout:
+                csvfile.close()
+            else:
+                csvfile.flush()
+
+    finally:
+        shutil.rmtree(part_dir, ignore_errors=True)
+
+    return(failed)